@@ -0,0 +1,366 @@
+"""
+ProThemesRU Telegram Bot - Admin commands
+/stats, /orders, /top_templates, /funnel, /campaigns and /latency for ADMIN_CHAT_ID,
+answered from incrementally maintained aggregates, /reload_templates and /traces
+"""
+
+import os
+import html
+import math
+import time
+import logging
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from telegram import Update
+from telegram.constants import MessageLimit, ParseMode
+from telegram.ext import Application, BaseHandler, CommandHandler, ContextTypes, ConversationHandler, TypeHandler, filters
+
+from analytics import event_tracker
+from i18n import catalog, get_locale
+from template_catalog import TemplateCatalogError
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ADMIN_CHAT_ID = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
+TOP_TEMPLATES_LIMIT = 10
+TRACES_LIMIT = 5
+TRACES_MAX = 20
+TRACE_SPANS_LIMIT = 5
+# Окно активности для /stats: более давние пользователи не хранятся
+ACTIVE_WINDOW_DAYS = 7
+
+# Группы обработчиков для замера времени: до антиспама и после всех остальных
+TIMING_START_GROUP = -2
+TIMING_END_GROUP = 2
+
+# Границы корзин гистограммы: от 1 мс до ~2 минут с шагом 25%
+LATENCY_BUCKETS = [0.001 * 1.25 ** i for i in range(53)]
+
+
+class LatencyHistogram:
+    """Гистограмма с фиксированными корзинами: запись и перцентили за O(1)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0
+
+    def record(self, seconds: float):
+        if seconds <= LATENCY_BUCKETS[0]:
+            index = 0
+        else:
+            index = min(len(LATENCY_BUCKETS), math.ceil(math.log(seconds / LATENCY_BUCKETS[0], 1.25)))
+        self.counts[index] += 1
+        self.total += 1
+
+    def percentile(self, p: float) -> float:
+        """Верхняя граница корзины, в которую попадает перцентиль p"""
+        if not self.total:
+            return 0.0
+        rank = math.ceil(self.total * p)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+
+
+class AdminStats:
+    """Агрегаты для админ-команд, обновляются на каждом апдейте"""
+
+    def __init__(self):
+        self.updates = 0
+        # пользователь -> день последней активности, день -> пользователи с этим днем;
+        # хранятся только последние ACTIVE_WINDOW_DAYS дней
+        self.last_active_day: Dict[int, int] = {}
+        self.users_by_day: Dict[int, Set[int]] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}
+        # Известные команды для маршрутов /latency, заполняется при первом замере
+        self.commands: Optional[FrozenSet[str]] = None
+
+    def touch(self, user_id: int, now: Optional[float] = None):
+        """Учет активности: пользователь переносится в корзину текущего дня"""
+        day = int((now if now is not None else time.time()) // 86400)
+        previous = self.last_active_day.get(user_id)
+        if previous == day:
+            return
+        if day not in self.users_by_day:
+            self._evict(day)
+        if previous is not None:
+            users = self.users_by_day[previous]
+            users.discard(user_id)
+            if not users:
+                del self.users_by_day[previous]
+        self.last_active_day[user_id] = day
+        self.users_by_day.setdefault(day, set()).add(user_id)
+
+    def _evict(self, today: int):
+        """Смена дня: удаление пользователей, неактивных дольше окна /stats"""
+        for day in [day for day in self.users_by_day if day <= today - ACTIVE_WINDOW_DAYS]:
+            for user_id in self.users_by_day.pop(day):
+                del self.last_active_day[user_id]
+
+    def active_users(self, days: int, now: Optional[float] = None) -> int:
+        today = int((now if now is not None else time.time()) // 86400)
+        return sum(len(self.users_by_day.get(today - offset, ())) for offset in range(days))
+
+    def record_latency(self, route: str, seconds: float):
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = LatencyHistogram()
+        histogram.record(seconds)
+
+
+admin_stats = AdminStats()
+
+
+def _commands(handlers: Iterable[BaseHandler]) -> FrozenSet[str]:
+    commands = set()
+    for handler in handlers:
+        if isinstance(handler, CommandHandler):
+            commands.update(handler.commands)
+        elif isinstance(handler, ConversationHandler):
+            commands.update(_commands(handler.entry_points))
+            commands.update(_commands(handler.fallbacks))
+            for state_handlers in handler.states.values():
+                commands.update(_commands(state_handlers))
+    return frozenset(commands)
+
+
+def registered_commands(application: Application) -> FrozenSet[str]:
+    """Команды, на которые у приложения есть обработчики"""
+    return _commands(handler for group in application.handlers.values() for handler in group)
+
+
+def update_route(update: Update, commands: Optional[FrozenSet[str]] = None) -> str:
+    """Имя маршрута для статистики: команда или callback_data без id.
+
+    Неизвестные команды (если передан список commands) попадают в cmd:other,
+    иначе каждая опечатка пользователя заводила бы свою гистограмму.
+    """
+    query = update.callback_query
+    if query is not None:
+        data = query.data or ''
+        prefix, _, rest = data.rpartition('_')
+        return f"cb:{prefix}" if rest.isdigit() else f"cb:{data}"
+    message = update.effective_message
+    if message is not None and message.text and message.text.startswith('/'):
+        parts = message.text[1:].split(maxsplit=1)
+        if parts:
+            command = parts[0].split('@')[0].lower()
+            if commands is not None and command not in commands:
+                command = 'other'
+            return f"cmd:{command}"
+    return 'message' if message is not None else 'other'
+
+
+def fit_message(lines: List[str]) -> str:
+    """Ответ в пределах лимита сообщения: лишние строки отбрасываются целиком, не разрезая HTML"""
+    text = lines[0]
+    for line in lines[1:]:
+        # Запас под строку-многоточие
+        if len(text) + len(line) + 3 > MessageLimit.MAX_TEXT_LENGTH:
+            return text + '\n…'
+        text += '\n' + line
+    return text
+
+
+async def mark_update_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Группа -2: отметка начала обработки и учет активности"""
+    context.started_at = time.perf_counter()
+    admin_stats.updates += 1
+    if update.effective_user is not None:
+        admin_stats.touch(update.effective_user.id)
+
+
+async def record_update_latency(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Группа 2: время обработки апдейта всеми обработчиками"""
+    started_at = getattr(context, 'started_at', None)
+    if started_at is not None:
+        if admin_stats.commands is None:
+            # Обработчики регистрируются до запуска, список собирается один раз
+            admin_stats.commands = registered_commands(context.application)
+        route = update_route(update, admin_stats.commands)
+        admin_stats.record_latency(route, time.perf_counter() - started_at)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пользователи и нагрузка.
+
+    Всего пользователей - уникальные /start из хранилища аналитики (все процессы).
+    Активность и апдейты считаются в памяти процесса с момента запуска; при
+    BOT_WORKERS > 1 каждый воркер видит только свой шард.
+    """
+    locale = get_locale(update)
+    steps = await event_tracker.funnel()
+    await update.effective_message.reply_text(
+        catalog.get(
+            locale, 'admin.stats',
+            total=steps[0]['users'] if steps else 0,
+            active_day=admin_stats.active_users(1),
+            active_week=admin_stats.active_users(ACTIVE_WINDOW_DAYS),
+            updates=admin_stats.updates
+        ),
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def orders_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Заказы по тарифам"""
+    locale = get_locale(update)
+    tiers = {tier: count for tier, count in event_tracker.counts_by_detail('order').items() if tier}
+    lines = [catalog.get(locale, 'admin.orders.header')]
+    lines += [
+        catalog.get(locale, 'admin.orders.item', tier=tier, count=count)
+        for tier, count in sorted(tiers.items(), key=lambda item: -item[1])
+    ] or [catalog.get(locale, 'admin.empty')]
+    await update.effective_message.reply_text('\n'.join(lines), parse_mode=ParseMode.HTML)
+
+
+async def top_templates_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Самые просматриваемые шаблоны"""
+    locale = get_locale(update)
+    template_name: Callable[[int], Optional[str]] = context.bot_data.get('template_name', lambda _: None)
+    lines = [catalog.get(locale, 'admin.top.header')]
+    lines += [
+        catalog.get(locale, 'admin.top.item', rank=rank,
+                    name=template_name(template_id) or f"#{template_id}", count=count)
+        for rank, (template_id, count) in enumerate(event_tracker.top_templates('view', TOP_TEMPLATES_LIMIT), 1)
+    ] or [catalog.get(locale, 'admin.empty')]
+    await update.effective_message.reply_text('\n'.join(lines), parse_mode=ParseMode.HTML)
+
+
+async def funnel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Уникальные пользователи по шагам воронки и переход из предыдущего шага"""
+    locale = get_locale(update)
+    steps = await event_tracker.funnel()
+    lines = [catalog.get(locale, 'admin.funnel.header')]
+    for step in steps:
+        name = catalog.get(locale, f"admin.funnel.step.{step['step']}")
+        if step['conversion'] is None:
+            lines.append(catalog.get(locale, 'admin.funnel.first', step=name, users=step['users']))
+        else:
+            lines.append(catalog.get(
+                locale, 'admin.funnel.item',
+                step=name, users=step['users'], conversion=round(step['conversion'] * 100, 1)
+            ))
+    if not any(step['users'] for step in steps):
+        lines = lines[:1] + [catalog.get(locale, 'admin.empty')]
+    await update.effective_message.reply_text('\n'.join(lines), parse_mode=ParseMode.HTML)
+
+
+async def campaigns_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Воронка по кампаниям deep-link (первое касание)"""
+    locale = get_locale(update)
+    lines = [catalog.get(locale, 'admin.campaigns.header')]
+    lines += [
+        catalog.get(
+            locale, 'admin.campaigns.item',
+            campaign=html.escape(item['campaign']),
+            users=item['start'],
+            selected=item['select'],
+            orders=item['order'],
+            conversion=round((item['conversion'] or 0) * 100, 1)
+        )
+        for item in await event_tracker.campaigns()
+    ] or [catalog.get(locale, 'admin.empty')]
+    await update.effective_message.reply_text('\n'.join(lines), parse_mode=ParseMode.HTML)
+
+
+async def latency_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Перцентили времени обработки по маршрутам"""
+    locale = get_locale(update)
+    lines: List[str] = [catalog.get(locale, 'admin.latency.header')]
+    for route, histogram in sorted(admin_stats.latency.items(), key=lambda item: -item[1].total):
+        lines.append(catalog.get(
+            locale, 'admin.latency.item',
+            route=route,
+            p50=round(histogram.percentile(0.5) * 1000),
+            p90=round(histogram.percentile(0.9) * 1000),
+            p99=round(histogram.percentile(0.99) * 1000),
+            count=histogram.total
+        ))
+    if len(lines) == 1:
+        lines.append(catalog.get(locale, 'admin.empty'))
+    await update.effective_message.reply_text(fit_message(lines), parse_mode=ParseMode.HTML)
+
+
+async def reload_templates_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Перечитать каталог шаблонов без перезапуска"""
+    locale = get_locale(update)
+    try:
+        snapshot = await context.bot_data['reload_templates'](force=True)
+    except TemplateCatalogError as e:
+        text = catalog.get(locale, 'admin.reload.error', error=str(e))
+    else:
+        text = catalog.get(locale, 'admin.reload.ok', count=len(snapshot), version=snapshot.version)
+    await update.effective_message.reply_text(text, parse_mode=ParseMode.HTML)
+
+
+async def traces_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Самые медленные трассы из буфера: /traces [N]"""
+    locale = get_locale(update)
+    if not tracer.enabled:
+        await update.effective_message.reply_text(catalog.get(locale, 'admin.traces.disabled'),
+                                                  parse_mode=ParseMode.HTML)
+        return
+    try:
+        limit = int(context.args[0])
+    except (IndexError, TypeError, ValueError):
+        limit = TRACES_LIMIT
+    limit = max(1, min(limit, TRACES_MAX))
+    lines: List[str] = [catalog.get(locale, 'admin.traces.header')]
+    for rank, trace in enumerate(tracer.slowest(limit), 1):
+        root = trace.root
+        route = root.attributes.get('telegram.command') or root.attributes.get('telegram.callback_data') or ''
+        lines.append(catalog.get(
+            locale, 'admin.traces.item',
+            rank=rank,
+            duration=round(trace.duration * 1000),
+            name=html.escape(f"{root.name} {route}".strip()),
+            trace_id=trace.trace_id
+        ))
+        children = sorted((s for s in trace.spans if s is not root), key=lambda s: -s.duration)
+        lines += [
+            catalog.get(locale, 'admin.traces.span', name=html.escape(child.name),
+                        duration=round(child.duration * 1000, 1))
+            for child in children[:TRACE_SPANS_LIMIT]
+        ]
+    if len(lines) == 1:
+        lines.append(catalog.get(locale, 'admin.empty'))
+    await update.effective_message.reply_text(fit_message(lines), parse_mode=ParseMode.HTML)
+
+
+def register_admin_handlers(application: Application,
+                            template_name: Optional[Callable[[int], Optional[str]]] = None,
+                            reload_templates: Optional[Callable[..., Awaitable]] = None):
+    """Замер времени для всех апдейтов и админ-команды, если задан ADMIN_CHAT_ID"""
+    application.add_handler(TypeHandler(Update, mark_update_start), group=TIMING_START_GROUP)
+    application.add_handler(TypeHandler(Update, record_update_latency), group=TIMING_END_GROUP)
+
+    if not ADMIN_CHAT_ID:
+        logger.info("TELEGRAM_ADMIN_CHAT_ID не задан, админ-команды отключены")
+        return
+
+    try:
+        admin_chat_id = int(ADMIN_CHAT_ID)
+    except ValueError:
+        logger.warning(f"TELEGRAM_ADMIN_CHAT_ID должен быть числом, получено {ADMIN_CHAT_ID!r}; "
+                       "админ-команды отключены")
+        return
+
+    if template_name is not None:
+        application.bot_data['template_name'] = template_name
+
+    admin_only = filters.Chat(chat_id=admin_chat_id)
+    application.add_handler(CommandHandler('stats', stats_command, filters=admin_only))
+    application.add_handler(CommandHandler('orders', orders_command, filters=admin_only))
+    application.add_handler(CommandHandler('top_templates', top_templates_command, filters=admin_only))
+    application.add_handler(CommandHandler('funnel', funnel_command, filters=admin_only))
+    application.add_handler(CommandHandler('campaigns', campaigns_command, filters=admin_only))
+    application.add_handler(CommandHandler('latency', latency_command, filters=admin_only))
+    application.add_handler(CommandHandler('traces', traces_command, filters=admin_only))
+    if reload_templates is not None:
+        application.bot_data['reload_templates'] = reload_templates
+        application.add_handler(CommandHandler('reload_templates', reload_templates_command, filters=admin_only))
@@ -0,0 +1,412 @@
+"""
+ProThemesRU Telegram Bot - Analytics event pipeline
+Handlers append events to an in-memory ring buffer, a scheduler job
+flushes batches into SQLite and maintains pre-aggregated rollups,
+including first-touch deep-link attribution and per-campaign funnels
+"""
+
+import os
+import re
+import time
+import heapq
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DB = os.getenv('ANALYTICS_DB', 'analytics.db')
+ANALYTICS_BUFFER_SIZE = int(os.getenv('ANALYTICS_BUFFER_SIZE', '10000'))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '5'))
+
+# Шаги воронки в порядке прохождения
+FUNNEL_STEPS = ('start', 'templates', 'view', 'select', 'order')
+
+# Команды, которые считаются шагами воронки (/order только открывает меню тарифов)
+COMMAND_EVENTS = {'start': 'start', 'templates': 'templates'}
+
+# Тарифы кнопок order_<тариф>; кнопка "Заказать" без тарифа заказом не считается
+ORDER_TIERS = ('basic', 'pro', 'premium', 'corporate')
+
+# Параметр ссылки t.me/<bot>?start=<payload>: до 64 символов A-Z, a-z, 0-9, _ и -
+DEEPLINK_PAYLOAD = re.compile(r'[A-Za-z0-9_-]{1,64}')
+# Новые кампании сверх лимита учитываются как одна, чтобы случайные ссылки не раздували таблицы
+DEEPLINK_MAX_CAMPAIGNS = int(os.getenv('DEEPLINK_MAX_CAMPAIGNS', '1000'))
+OVERFLOW_CAMPAIGN = 'other'
+
+# (время, событие, пользователь, шаблон, детали, кампания)
+# Кампания хранится отдельно от деталей: агрегаты по деталям не растут от параметров ссылок
+Event = Tuple[int, str, Optional[int], Optional[int], str, Optional[str]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    user_id INTEGER,
+    template_id INTEGER,
+    detail TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS event_hourly (
+    hour INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    detail TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (hour, event, detail)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS template_hourly (
+    hour INTEGER NOT NULL,
+    template_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (hour, template_id, event)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS funnel_users (
+    step TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    first_ts INTEGER NOT NULL,
+    PRIMARY KEY (step, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS funnel_counts (
+    step TEXT PRIMARY KEY,
+    users INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS attribution (
+    user_id INTEGER PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attribution_campaign ON attribution (campaign_id, ts);
+CREATE TABLE IF NOT EXISTS campaign_funnel (
+    campaign_id INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    users INTEGER NOT NULL,
+    PRIMARY KEY (campaign_id, step)
+) WITHOUT ROWID;
+"""
+
+
+def campaign_from_args(args: Optional[List[str]]) -> Optional[str]:
+    """Кампания из параметра /start (context.args); неподходящий параметр игнорируется"""
+    if not args or not DEEPLINK_PAYLOAD.fullmatch(args[0]):
+        return None
+    return args[0].lower()
+
+
+def classify_update(update: Update) -> Optional[Tuple[str, Optional[int], str]]:
+    """Событие аналитики для апдейта: (тип, id шаблона, детали)"""
+    query = update.callback_query
+    if query is not None:
+        data = query.data or ''
+        if data in ('templates', 'more_templates'):
+            return 'templates', None, ''
+        prefix, _, rest = data.partition('_')
+        if prefix in ('view', 'select') and rest.isdigit():
+            return prefix, int(rest), ''
+        if prefix == 'order':
+            if rest.isdigit():
+                return 'order', int(rest), ''
+            if rest in ORDER_TIERS:
+                return 'order', None, rest
+        return None
+
+    message = update.effective_message
+    if message is not None and message.text and message.text.startswith('/'):
+        parts = message.text[1:].split(maxsplit=1)
+        event = COMMAND_EVENTS.get(parts[0].split('@')[0]) if parts else None
+        if event is not None:
+            return event, None, ''
+    return None
+
+
+class EventStore:
+    """Append-only журнал событий и инкрементальные агрегаты в SQLite"""
+
+    def __init__(self, path: str = ANALYTICS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL позволяет воркерам-шардам писать в один файл без долгих блокировок
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._campaign_ids: Dict[str, int] = dict(self._conn.execute('SELECT name, campaign_id FROM campaigns'))
+
+    def _campaign_id(self, name: str) -> int:
+        """id кампании; новая добавляется в справочник (вызывается внутри транзакции)"""
+        campaign_id = self._campaign_ids.get(name)
+        if campaign_id is None:
+            if len(self._campaign_ids) >= DEEPLINK_MAX_CAMPAIGNS and name != OVERFLOW_CAMPAIGN:
+                return self._campaign_id(OVERFLOW_CAMPAIGN)
+            # Ту же кампанию мог добавить воркер другого шарда
+            self._conn.execute('INSERT OR IGNORE INTO campaigns (name) VALUES (?)', (name,))
+            campaign_id = self._campaign_ids[name] = self._conn.execute(
+                'SELECT campaign_id FROM campaigns WHERE name = ?', (name,)
+            ).fetchone()[0]
+        return campaign_id
+
+    def _attribute(self, user_id: int, campaign: str, ts: int):
+        """Первое касание: за кампанией закрепляется только новый пользователь.
+
+        Пользователь, у которого уже есть шаг start, пришел не по ссылке, и его
+        прежние шаги и заказы кампании не засчитываются.
+        """
+        if self._conn.execute(
+            "SELECT 1 FROM funnel_users WHERE step = 'start' AND user_id = ?", (user_id,)
+        ).fetchone():
+            return
+        # Ту же ссылку мог обработать воркер другого шарда - запись останется первой
+        self._conn.execute(
+            'INSERT OR IGNORE INTO attribution (user_id, campaign_id, ts) VALUES (?, ?, ?)',
+            (user_id, self._campaign_id(campaign), ts)
+        )
+
+    def write_batch(self, batch: List[Event]):
+        """Запись пачки событий и обновление агрегатов в одной транзакции"""
+        event_hourly: Dict[Tuple[int, str, str], int] = {}
+        template_hourly: Dict[Tuple[int, int, str], int] = {}
+        for ts, event, _, template_id, detail, _ in batch:
+            hour = ts // 3600 * 3600
+            key = (hour, event, detail)
+            event_hourly[key] = event_hourly.get(key, 0) + 1
+            if template_id is not None:
+                tkey = (hour, template_id, event)
+                template_hourly[tkey] = template_hourly.get(tkey, 0) + 1
+
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT INTO events (ts, event, user_id, template_id, detail) VALUES (?, ?, ?, ?, ?)',
+                        [row[:5] for row in batch]
+                    )
+                    self._conn.executemany(
+                        'INSERT INTO event_hourly (hour, event, detail, count) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (hour, event, detail) DO UPDATE SET count = count + excluded.count',
+                        [(*key, count) for key, count in event_hourly.items()]
+                    )
+                    self._conn.executemany(
+                        'INSERT INTO template_hourly (hour, template_id, event, count) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (hour, template_id, event) DO UPDATE SET count = count + excluded.count',
+                        [(*key, count) for key, count in template_hourly.items()]
+                    )
+
+                    # Воронка: каждый пользователь учитывается в шаге один раз,
+                    # а для пришедших по ссылке - еще и в воронке своей кампании
+                    new_users: Dict[str, int] = {}
+                    campaign_users: Dict[Tuple[int, str], int] = {}
+                    for ts, event, user_id, _, _, campaign in batch:
+                        if user_id is None:
+                            continue
+                        if campaign:
+                            self._attribute(user_id, campaign, ts)
+                        if event not in FUNNEL_STEPS:
+                            continue
+                        cursor = self._conn.execute(
+                            'INSERT OR IGNORE INTO funnel_users (step, user_id, first_ts) VALUES (?, ?, ?)',
+                            (event, user_id, ts)
+                        )
+                        if cursor.rowcount:
+                            new_users[event] = new_users.get(event, 0) + 1
+                            # Кампании засчитываются только шаги после перехода по ссылке
+                            row = self._conn.execute(
+                                'SELECT campaign_id FROM attribution WHERE user_id = ? AND ts <= ?',
+                                (user_id, ts)
+                            ).fetchone()
+                            if row is not None:
+                                key = (row[0], event)
+                                campaign_users[key] = campaign_users.get(key, 0) + 1
+                    self._conn.executemany(
+                        'INSERT INTO funnel_counts (step, users) VALUES (?, ?) '
+                        'ON CONFLICT (step) DO UPDATE SET users = users + excluded.users',
+                        list(new_users.items())
+                    )
+                    self._conn.executemany(
+                        'INSERT INTO campaign_funnel (campaign_id, step, users) VALUES (?, ?, ?) '
+                        'ON CONFLICT (campaign_id, step) DO UPDATE SET users = users + excluded.users',
+                        [(*key, users) for key, users in campaign_users.items()]
+                    )
+            except sqlite3.Error:
+                # Транзакция откатилась - справочник кампаний в памяти мог получить лишние id
+                self._campaign_ids = dict(self._conn.execute('SELECT name, campaign_id FROM campaigns'))
+                raise
+
+    def totals(self) -> Tuple[List[Tuple[str, str, int]], List[Tuple[str, int, int]]]:
+        """Итоги за все время для начального заполнения счетчиков в памяти"""
+        with self._lock:
+            details = self._conn.execute(
+                'SELECT event, detail, SUM(count) FROM event_hourly GROUP BY event, detail'
+            ).fetchall()
+            templates = self._conn.execute(
+                'SELECT event, template_id, SUM(count) FROM template_hourly GROUP BY event, template_id'
+            ).fetchall()
+        return details, templates
+
+    def funnel(self) -> List[Dict]:
+        """Уникальные пользователи на каждом шаге и конверсия из предыдущего"""
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT step, users FROM funnel_counts').fetchall())
+        result = []
+        previous = None
+        for step in FUNNEL_STEPS:
+            users = counts.get(step, 0)
+            result.append({
+                "step": step,
+                "users": users,
+                "conversion": round(users / previous, 3) if previous else None,
+            })
+            previous = users
+        return result
+
+    def campaigns(self) -> List[Dict]:
+        """Воронка по кампаниям из готовых счетчиков: пользователи на шагах и конверсия в заказ"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT c.name, f.step, f.users FROM campaign_funnel f JOIN campaigns c USING (campaign_id)'
+            ).fetchall()
+        steps: Dict[str, Dict[str, int]] = {}
+        for name, step, users in rows:
+            steps.setdefault(name, {})[step] = users
+        result = []
+        for name, counts in steps.items():
+            users = counts.get('start', 0)
+            result.append({
+                "campaign": name,
+                **{step: counts.get(step, 0) for step in FUNNEL_STEPS},
+                "conversion": round(counts.get('order', 0) / users, 3) if users else None,
+            })
+        return sorted(result, key=lambda item: -item['start'])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EventTracker:
+    """Кольцевой буфер событий; flush() раз в flush_interval вызывает планировщик"""
+
+    def __init__(self, path: str = ANALYTICS_DB, buffer_size: int = ANALYTICS_BUFFER_SIZE,
+                 flush_interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buffer: Deque[Event] = deque(maxlen=buffer_size)
+        self.store: Optional[EventStore] = None
+        self.dropped = 0
+        self.flushed = 0
+        self.last_flush_duration = 0.0
+
+        # Счетчики за все время, обновляются при каждом track(): событие -> деталь/шаблон -> количество
+        self.detail_counts: Dict[str, Dict[str, int]] = {}
+        self.template_counts: Dict[str, Dict[int, int]] = {}
+
+    def track(self, event: str, user_id: Optional[int] = None,
+              template_id: Optional[int] = None, detail: str = '', campaign: Optional[str] = None):
+        """Неблокирующая запись события; при переполнении теряются самые старые"""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((int(time.time()), event, user_id, template_id, detail, campaign))
+        self._count(event, template_id, detail)
+
+    def _count(self, event: str, template_id: Optional[int], detail: str, n: int = 1):
+        details = self.detail_counts.setdefault(event, {})
+        details[detail] = details.get(detail, 0) + n
+        if template_id is not None:
+            templates = self.template_counts.setdefault(event, {})
+            templates[template_id] = templates.get(template_id, 0) + n
+
+    def counts_by_detail(self, event: str) -> Dict[str, int]:
+        """Количество событий по деталям без обращения к хранилищу"""
+        return dict(self.detail_counts.get(event, {}))
+
+    def top_templates(self, event: str = 'view', limit: int = 10) -> List[Tuple[int, int]]:
+        """Топ шаблонов по счетчикам в памяти (размер зависит только от каталога)"""
+        return heapq.nlargest(limit, self.template_counts.get(event, {}).items(), key=lambda item: item[1])
+
+    async def flush(self):
+        """Сброс накопленных событий в хранилище вне event loop"""
+        if not self.buffer or self.store is None:
+            return
+        batch = list(self.buffer)
+        self.buffer.clear()
+        started = time.perf_counter()
+        try:
+            with span('store analytics.write_batch', events=len(batch)):
+                await asyncio.get_running_loop().run_in_executor(None, self.store.write_batch, batch)
+        except Exception as e:
+            # Транзакция откатилась: пачка возвращается в начало буфера до следующего сброса
+            logger.error(f"Ошибка записи аналитики ({len(batch)} событий), повтор при следующем сбросе: {e}")
+            free = self.buffer.maxlen - len(self.buffer)
+            if len(batch) > free:
+                self.dropped += len(batch) - free
+                batch = batch[len(batch) - free:]
+            self.buffer.extendleft(reversed(batch))
+            return
+        self.flushed += len(batch)
+        self.last_flush_duration = time.perf_counter() - started
+
+    async def start(self):
+        if self.store is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self.store = await loop.run_in_executor(None, EventStore, self.path)
+
+        details, templates = await loop.run_in_executor(None, self.store.totals)
+        for event, detail, count in details:
+            self._count(event, None, detail, count)
+        for event, template_id, count in templates:
+            templates_by_event = self.template_counts.setdefault(event, {})
+            templates_by_event[template_id] = templates_by_event.get(template_id, 0) + count
+
+    async def stop(self):
+        if self.store is None:
+            return
+        await self.flush()
+        self.store.close()
+        self.store = None
+
+    async def funnel(self) -> List[Dict]:
+        """Воронка с учетом еще не сброшенных событий"""
+        if self.store is None:
+            return []
+        await self.flush()
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.funnel)
+
+    async def campaigns(self) -> List[Dict]:
+        """Отчет по кампаниям с учетом еще не сброшенных событий"""
+        if self.store is None:
+            return []
+        await self.flush()
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.campaigns)
+
+    def get_stats(self) -> Dict:
+        return {
+            "buffered": len(self.buffer),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.last_flush_duration * 1000, 2),
+        }
+
+
+event_tracker = EventTracker()
+
+
+async def track_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Наблюдатель (группа 1): фиксирует шаги воронки после основных обработчиков"""
+    event = classify_update(update)
+    if event is None:
+        return
+    user = update.effective_user
+    # Кампанию из параметра /start разбирает обработчик команды (context.args)
+    campaign = getattr(context, 'campaign', None) if event[0] == 'start' else None
+    event_tracker.track(event[0], user.id if user else None, event[1], event[2], campaign)
@@ -1,13 +1,30 @@
 #!/usr/bin/env python3
 """
 ProThemesRU Telegram Bot - Main Application
-Deployment-ready Flask application for Render
+Async aiohttp web application for Render, can share the event loop with the bot
 """
 
 import os
 import logging
-from flask import Flask, request, jsonify
+import asyncio
+import hashlib
+import dataclasses
 import json
+import gzip
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Callable, Dict, Optional, Tuple
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from template_catalog import TemplateCatalog, TemplateManager
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
 
 # Configure logging
 logging.basicConfig(
@@ -16,98 +33,290 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-
 # Bot configuration
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_CHAT_ID = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
-def load_templates():
-    """Load templates from JSON files"""
-    try:
-        with open('templates/blocks/premium_templates.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logger.warning("Templates file not found, using default")
-        return {
-            "premium_templates": [
-                {
-                    "id": 1,
-                    "name": "Современный SaaS Лендинг",
-                    "category": "saas",
-                    "price": 15000,
-                    "description": "Премиум лендинг для SaaS продуктов"
-                },
-                {
-                    "id": 2,
-                    "name": "Креативное Агентство",
-                    "category": "agency",
-                    "price": 12000,
-                    "description": "Стильный сайт для креативных агентств"
-                },
-                {
-                    "id": 3,
-                    "name": "Премиум E-commerce",
-                    "category": "ecommerce",
-                    "price": 25000,
-                    "description": "Полнофункциональный интернет-магазин"
-                }
-            ]
+# Web server configuration
+KEEPALIVE_TIMEOUT = float(os.getenv('KEEPALIVE_TIMEOUT', '75'))
+TEMPLATES_CACHE_CONTROL = os.getenv('TEMPLATES_CACHE_CONTROL', 'public, max-age=60')
+MAX_PROJECTIONS = 64
+VERSION = "1.0.0"
+
+def catalog_body(items: list) -> dict:
+    """Response layout of templates.json: one list per tier"""
+    body = {"premium_templates": []}
+    for item in items:
+        body.setdefault(f"{item['tier']}_templates", []).append(item)
+    return body
+
+def dump_json(data) -> bytes:
+    """Serialize a response body once"""
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def json_response(body: bytes, status: int = 200, headers: Optional[dict] = None) -> web.Response:
+    """Wrap a pre-serialized JSON body"""
+    return web.Response(body=body, status=status, headers=headers,
+                        content_type='application/json', charset='utf-8')
+
+def parse_accept_encoding(header: str) -> set:
+    """Content codings the client accepts (q=0 excluded)"""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def etag_matches(header: str, etags: set) -> bool:
+    """Weak comparison of If-None-Match against the known ETags"""
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) in etags:
+            return True
+    return False
+
+class Representation:
+    """One serialized view of the catalog with its pre-compressed variants"""
+
+    def __init__(self, data):
+        self.body = dump_json(data)
+        digest = hashlib.sha1(self.body).hexdigest()
+        self.etag = f'"{digest}"'
+        self.encoded = {'gzip': (gzip.compress(self.body, 9), f'"{digest}-gzip"')}
+        if brotli is not None:
+            self.encoded['br'] = (brotli.compress(self.body, quality=11), f'"{digest}-br"')
+        self.etags = {self.etag} | {etag for _, etag in self.encoded.values()}
+
+    def select(self, accept_encoding: str):
+        """Pick the smallest variant the client accepts"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.encoded:
+                body, etag = self.encoded[encoding]
+                return body, etag, encoding
+        return self.body, self.etag, None
+
+class CatalogSnapshot:
+    """Every response derived from one version of the catalog"""
+
+    def __init__(self, items: list, mtime: Optional[float] = None):
+        self.mtime = mtime
+        self.items = items
+        self.count = len(self.items)
+        self.fields = frozenset(key for item in self.items for key in item)
+
+        categories = {}
+        for item in self.items:
+            categories.setdefault(item.get('category'), []).append(item)
+
+        self.full = Representation(catalog_body(items))
+        self.categories = {
+            category: Representation(catalog_body(category_items))
+            for category, category_items in categories.items()
         }
+        self.empty = Representation(catalog_body([]))
+        # Field projections are built on first request and memoized per snapshot
+        self.projections = OrderedDict()
+        self.last_modified = formatdate(mtime if mtime is not None else time.time(), usegmt=True)
+        self.home_body = dump_json({
+            "status": "success",
+            "message": "ProThemesRU Telegram Bot is running!",
+            "version": VERSION,
+            "templates_count": self.count,
+            "endpoints": {
+                "webhook": "/webhook",
+                "health": "/health",
+                "status": "/status",
+                "templates": "/templates"
+            }
+        })
+
+    def project(self, fields: Tuple[str, ...], category: Optional[str]) -> Representation:
+        items = self.items if category is None else [t for t in self.items if t.get('category') == category]
+        return Representation({
+            section: [{key: item[key] for key in fields if key in item} for item in section_items]
+            for section, section_items in catalog_body(items).items()
+        })
+
+class TemplatesCache:
+    """Pre-serialized templates catalog, rebuilt whenever TemplateManager reloads it"""
+
+    def __init__(self):
+        self.snapshot = CatalogSnapshot([])
+        self.catalog: Optional[TemplateCatalog] = None
 
-# Flask routes
-@app.route('/')
-def home():
+    async def update(self, catalog: TemplateCatalog):
+        """TemplateManager listener: serialize and compress in a worker thread"""
+        if catalog is self.catalog:
+            return
+        items = [dataclasses.asdict(template) for template in catalog.templates]
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, CatalogSnapshot, items, catalog.mtime)
+        # The swap happens on the event loop, requests never see a half-built catalog
+        self.snapshot = snapshot
+        self.catalog = catalog
+        logger.info(f"Templates catalog loaded: {snapshot.count} templates (version {catalog.version})")
+
+    async def representation(self, fields: Optional[Tuple[str, ...]] = None,
+                             category: Optional[str] = None) -> Tuple[CatalogSnapshot, Representation]:
+        """Full catalog, a category slice, or a memoized field projection"""
+        snapshot = self.snapshot
+        if fields is None:
+            if category is None:
+                return snapshot, snapshot.full
+            return snapshot, snapshot.categories.get(category, snapshot.empty)
+
+        key = (fields, category)
+        cached = snapshot.projections.get(key)
+        if cached is not None:
+            snapshot.projections.move_to_end(key)
+            return snapshot, cached
+
+        projected = await asyncio.get_running_loop().run_in_executor(None, snapshot.project, fields, category)
+        snapshot.projections[key] = projected
+        if len(snapshot.projections) > MAX_PROJECTIONS:
+            snapshot.projections.popitem(last=False)
+        return snapshot, projected
+
+templates_cache = TemplatesCache()
+
+HEALTH_BODY = dump_json({
+    "status": "healthy",
+    "bot_token": "configured" if BOT_TOKEN else "missing",
+    "admin_chat_id": "configured" if ADMIN_CHAT_ID else "missing"
+})
+WEBHOOK_OK_BODY = dump_json({"status": "ok"})
+
+# Subsystems publish their state on /status through these callables
+STATUS_PROVIDERS: Dict[str, Callable[[], dict]] = {}
+
+def register_status_provider(name: str, provider: Callable[[], dict]):
+    """Expose a subsystem's stats under its name on /status"""
+    STATUS_PROVIDERS[name] = provider
+
+# Web routes
+async def home(request: web.Request) -> web.Response:
     """Home page"""
-    return jsonify({
-        "status": "success",
-        "message": "ProThemesRU Telegram Bot is running!",
-        "version": "1.0.0",
-        "templates_count": len(load_templates().get('premium_templates', [])),
-        "endpoints": {
-            "webhook": "/webhook",
-            "health": "/health",
-            "status": "/status",
-            "templates": "/templates"
-        }
-    })
+    return json_response(templates_cache.snapshot.home_body)
+
+async def templates(request: web.Request) -> web.Response:
+    """Get templates list (?fields=id,name,price&category=saas)"""
+    fields = None
+    if request.query.get('fields'):
+        snapshot = templates_cache.snapshot
+        requested = [f.strip() for f in request.query['fields'].split(',') if f.strip()]
+        fields = tuple(dict.fromkeys(f for f in requested if f in snapshot.fields))
+        if not fields:
+            return json_response(dump_json({"error": "unknown fields"}), status=400)
 
-@app.route('/templates')
-def templates():
-    """Get templates list"""
-    templates_data = load_templates()
-    return jsonify(templates_data)
+    snapshot, representation = await templates_cache.representation(fields, request.query.get('category'))
+    body, etag, encoding = representation.select(request.headers.get('Accept-Encoding', ''))
+    headers = {
+        "ETag": etag,
+        "Last-Modified": snapshot.last_modified,
+        "Cache-Control": TEMPLATES_CACHE_CONTROL,
+        "Vary": "Accept-Encoding"
+    }
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if etag_matches(if_none_match, representation.etags):
+            return web.Response(status=304, headers=headers)
+    elif request.headers.get('If-Modified-Since') == snapshot.last_modified:
+        return web.Response(status=304, headers=headers)
+
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return json_response(body, headers=headers)
+
+async def webhook(request: web.Request) -> web.Response:
     """Handle webhook from Telegram"""
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return json_response(dump_json({"error": "forbidden"}), status=403)
+
     try:
-        data = request.get_json()
-        logger.info(f"Received webhook: {data}")
-        return jsonify({"status": "ok"})
+        data = await request.json()
+        application = request.app['bot_application']
+        if application is None:
+            logger.info(f"Received webhook: {data}")
+        else:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        return json_response(WEBHOOK_OK_BODY)
     except Exception as e:
         logger.error(f"Error processing webhook: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response(dump_json({"error": str(e)}), status=500)
 
-@app.route('/health')
-def health():
+async def health(request: web.Request) -> web.Response:
     """Health check endpoint"""
-    return jsonify({
-        "status": "healthy",
-        "bot_token": "configured" if BOT_TOKEN else "missing",
-        "admin_chat_id": "configured" if ADMIN_CHAT_ID else "missing"
-    })
+    return json_response(HEALTH_BODY)
 
-@app.route('/status')
-def status():
+async def status(request: web.Request) -> web.Response:
     """Status endpoint"""
-    return jsonify({
+    data = {
         "status": "running",
         "bot_token": "configured" if BOT_TOKEN else "missing",
-        "templates_loaded": len(load_templates().get('premium_templates', []))
-    })
+        "templates_loaded": templates_cache.snapshot.count
+    }
+    application = request.app['bot_application']
+    if application is not None:
+        data["bot"] = "running" if application.running else "stopped"
+    for name, provider in STATUS_PROVIDERS.items():
+        try:
+            data[name] = provider()
+        except Exception as e:
+            logger.error(f"Status provider {name} failed: {e}")
+            data[name] = {"error": str(e)}
+    return json_response(dump_json(data))
+
+async def watch_templates(manager: TemplateManager):
+    """Catalog file check for a web-only manager (the bot's one is run by its scheduler)"""
+    while True:
+        await asyncio.sleep(manager.check_interval)
+        await manager.refresh()
+
+async def on_startup(app: web.Application):
+    manager = app['template_manager']
+    await manager.subscribe(templates_cache.update)
+    app['templates_watcher'] = None
+    if app['owns_template_manager'] and manager.check_interval > 0:
+        app['templates_watcher'] = asyncio.create_task(watch_templates(manager))
+
+async def on_cleanup(app: web.Application):
+    if app['templates_watcher'] is not None:
+        app['templates_watcher'].cancel()
+
+def create_app(bot_application: Optional[Application] = None,
+               template_manager: Optional[TemplateManager] = None) -> web.Application:
+    """Build the web application, optionally bound to a running bot and its catalog"""
+    app = web.Application()
+    app['bot_application'] = bot_application
+    # The bot's TemplateManager (reloaded by its scheduler and /reload_templates) feeds /templates
+    app['template_manager'] = template_manager if template_manager is not None else TemplateManager()
+    app['owns_template_manager'] = template_manager is None
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get('/', home)
+    app.router.add_get('/templates', templates)
+    app.router.add_post('/webhook', webhook)
+    app.router.add_get('/health', health)
+    app.router.add_get('/status', status)
+    return app
+
+async def start_web_server(bot_application: Optional[Application] = None,
+                           host: str = '0.0.0.0', port: int = 5000,
+                           template_manager: Optional[TemplateManager] = None) -> web.AppRunner:
+    """Serve the web application inside the caller's event loop"""
+    runner = web.AppRunner(create_app(bot_application, template_manager), access_log=None,
+                           keepalive_timeout=KEEPALIVE_TIMEOUT)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Web server listening on {host}:{port}")
+    return runner
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
+    web.run_app(create_app(), host='0.0.0.0', port=port, access_log=None,
+                keepalive_timeout=KEEPALIVE_TIMEOUT)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+ProThemesRU Telegram Bot - User storage memory benchmark
+Compares bytes per user of the legacy dict layout of UserManager
+with the slotted UserRecord on synthetic users:
+
+    python benchmark_memory.py --users 1000000
+"""
+
+import gc
+import argparse
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict
+
+from records import UserRecord
+
+
+def synthetic_profile(i: int) -> Dict:
+    """Профиль как из Telegram: фамилия и username есть не у всех"""
+    return {
+        "first_name": f"User{i}",
+        "last_name": f"Last{i}" if i % 2 else None,
+        "username": f"user_{i}" if i % 3 else None,
+    }
+
+
+def legacy_user(user_id: int, user_data: Dict) -> Dict:
+    """Прежний формат UserManager.add_user"""
+    return {
+        "id": user_id,
+        "created_at": datetime.now(),
+        "last_activity": datetime.now(),
+        "selected_template": None,
+        "customization_data": {},
+        "orders": [],
+        **user_data
+    }
+
+
+def record_user(user_id: int, user_data: Dict) -> UserRecord:
+    return UserRecord(user_id, **user_data)
+
+
+def measure(build: Callable[[int, Dict], object], count: int) -> float:
+    """Байт на пользователя: все выделения при заполнении хранилища, включая сам словарь users"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    users = {}
+    for i in range(count):
+        user_id = 100_000_000 + i
+        users[user_id] = build(user_id, synthetic_profile(i))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del users
+    gc.collect()
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per user: legacy dicts vs UserRecord")
+    parser.add_argument('--users', type=int, default=1_000_000, help="number of synthetic users")
+    args = parser.parse_args()
+
+    legacy = measure(legacy_user, args.users)
+    compact = measure(record_user, args.users)
+    print(f"users:        {args.users:,}")
+    print(f"dict layout:  {legacy:,.0f} B/user ({legacy * args.users / 2 ** 20:,.0f} MiB)")
+    print(f"UserRecord:   {compact:,.0f} B/user ({compact * args.users / 2 ** 20:,.0f} MiB)")
+    print(f"saved:        {1 - compact / legacy:.0%}")
+
+
+if __name__ == '__main__':
+    main()
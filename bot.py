@@ -1,10 +1,8 @@
 import os
 import logging
-import json
 import asyncio
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaDocument
+from typing import Dict, Optional, Any
+from telegram import Bot, Update, InlineKeyboardMarkup, InputMediaPhoto, InputMediaDocument
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -13,14 +11,28 @@ from telegram.ext import (
     ContextTypes,
     filters,
     ConversationHandler,
+    TypeHandler,
 )
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 from dotenv import load_dotenv
 import requests
-import aiohttp
 from PIL import Image
 import io
 
+from throttling import throttle_middleware
+from navigation import deferred_answer, show_screen, toast
+from i18n import catalog, get_locale, layout
+from sharding import BOT_WORKERS, ShardedDispatcher
+from analytics import campaign_from_args, event_tracker, track_update
+from admin import register_admin_handlers
+from template_catalog import TemplateManager, format_price
+from records import UserRecord, epoch
+from bot_api import BOT_API_FILE_URL, BOT_API_URL, ResilientRequest, non_critical
+from polling import allowed_updates_for, run_polling
+from scheduler import scheduler
+from tracing import TracingApplication, TRACE_EXPORT_INTERVAL, instrument, span, tracer
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -39,20 +51,48 @@ logger = logging.getLogger(__name__)
 SELECTING_ACTION, TEMPLATES, CUSTOMIZATION, ORDER, PAYMENT, FEEDBACK = range(6)
 
 # Кнопки главного меню
-MAIN_MENU = [
-    [
-        InlineKeyboardButton("📚 Шаблоны", callback_data='templates'),
-        InlineKeyboardButton("🎨 Конструктор", callback_data='customization'),
-    ],
-    [
-        InlineKeyboardButton("📦 Заказать", callback_data='order'),
-        InlineKeyboardButton("💰 Цены", callback_data='pricing'),
-    ],
-    [
-        InlineKeyboardButton("❓ Помощь", callback_data='help'),
-        InlineKeyboardButton("📞 Контакты", callback_data='contacts'),
-    ],
-]
+MAIN_MENU = layout(
+    [('btn.templates', 'templates'), ('btn.customization', 'customization')],
+    [('btn.order', 'order'), ('btn.pricing', 'pricing')],
+    [('btn.help', 'help'), ('btn.contacts', 'contacts')],
+)
+
+# Клавиатуры экранов
+BACK_TO_MAIN_MENU = layout(
+    [('btn.back_to_main', 'back_to_main')],
+)
+MORE_TEMPLATES_MENU = layout(
+    [('btn.more_templates', 'more_templates')],
+    [('btn.back_to_main', 'back_to_main')],
+)
+CUSTOMIZATION_MENU = layout(
+    [('btn.customize_colors', 'customize_colors'), ('btn.customize_content', 'customize_content')],
+    [('btn.customize_images', 'customize_images'), ('btn.customize_fonts', 'customize_fonts')],
+    [('btn.customize_responsive', 'customize_responsive'), ('btn.customize_animations', 'customize_animations')],
+    [('btn.preview_site', 'preview_site'), ('btn.save_customization', 'save_customization')],
+    [('btn.back_to_main', 'back_to_main')],
+)
+ORDER_MENU = layout(
+    [('btn.order_basic', 'order_basic'), ('btn.order_pro', 'order_pro')],
+    [('btn.order_premium', 'order_premium'), ('btn.order_corporate', 'order_corporate')],
+    [('btn.back_to_main', 'back_to_main')],
+)
+PRICING_MENU = layout(
+    [('btn.order', 'order'), ('btn.consultation', 'consultation')],
+    [('btn.back_to_main', 'back_to_main')],
+)
+HELP_MENU = layout(
+    [('btn.support', 'support'), ('btn.email_support', 'email_support')],
+    [('btn.back_to_main', 'back_to_main')],
+)
+CONTACTS_MENU = layout(
+    [('btn.call_us', 'call_us'), ('btn.telegram_contact', 'telegram_contact')],
+    [('btn.email_contact', 'email_contact'), ('btn.website', 'website')],
+    [('btn.back_to_main', 'back_to_main')],
+)
+
+# Кнопки связи, которые отвечают контактами без смены экрана
+CONTACT_BUTTONS_PATTERN = '^(consultation|support|email_support|call_us|telegram_contact|email_contact|website)$'
 
 # API конфигурация
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5000')
@@ -62,119 +102,135 @@ ADMIN_CHAT_ID = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
 # Хранилище данных пользователей (в продакшене использовать Redis/DB)
 user_data = {}
 
-class TemplateManager:
-    """Менеджер для работы с шаблонами"""
-    
-    def __init__(self):
-        self.templates = self._load_templates()
-    
-    def _load_templates(self) -> List[Dict]:
-        """Загрузка шаблонов из локального файла"""
-        try:
-            # Пробуем разные пути к файлу шаблонов
-            template_paths = [
-                'templates/blocks/premium_templates.json',
-                '../templates/blocks/premium_templates.json',
-                'design_templates.json',
-                '../design_templates.json'
-            ]
-            
-            for path in template_paths:
-                try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # Если файл содержит вложенную структуру
-                        if 'premium_templates' in data:
-                            return data['premium_templates']
-                        elif 'templates' in data:
-                            return data['templates']
-                        else:
-                            return data
-                except FileNotFoundError:
-                    continue
-            
-            logger.warning("Файл шаблонов не найден, используем демо-данные")
-            return self._get_demo_templates()
-        except Exception as e:
-            logger.error(f"Ошибка загрузки шаблонов: {e}")
-            return self._get_demo_templates()
-    
-    def _get_demo_templates(self) -> List[Dict]:
-        """Демо-шаблоны"""
-        return [
-            {
-                "id": 1,
-                "name": "Бизнес-лендинг",
-                "category": "Бизнес",
-                "features": ["Адаптивный дизайн", "SEO-оптимизация", "Формы обратной связи"],
-                "preview_image": "https://via.placeholder.com/300x200/4A90E2/FFFFFF?text=Бизнес-лендинг",
-                "price": "5000₽",
-                "description": "Современный лендинг для бизнеса"
-            },
-            {
-                "id": 2,
-                "name": "Портфолио",
-                "category": "Портфолио",
-                "features": ["Галерея работ", "Анимации", "Контактная форма"],
-                "preview_image": "https://via.placeholder.com/300x200/50C878/FFFFFF?text=Портфолио",
-                "price": "4000₽",
-                "description": "Стильное портфолио для творческих людей"
-            },
-            {
-                "id": 3,
-                "name": "Интернет-магазин",
-                "category": "E-commerce",
-                "features": ["Каталог товаров", "Корзина", "Онлайн-оплата"],
-                "preview_image": "https://via.placeholder.com/300x200/FF6B6B/FFFFFF?text=Магазин",
-                "price": "8000₽",
-                "description": "Полнофункциональный интернет-магазин"
-            }
+template_manager = TemplateManager()
+
+# Шаблонов на одной странице каталога
+TEMPLATES_PAGE_SIZE = 3
+
+# Пользователь считается активным, если заходил за последние 7 дней
+ACTIVE_USER_WINDOW = 7 * 24 * 3600
+# Неактивные дольше этого пользователи удаляются из памяти фоновой задачей
+USER_RETENTION_DAYS = int(os.getenv('USER_RETENTION_DAYS', '30'))
+USER_PRUNE_INTERVAL = float(os.getenv('USER_PRUNE_INTERVAL', '3600'))
+USER_PRUNE_CHUNK = 10000
+USER_ACTIVITY_GROUP = 3
+# Служебный чат для заранее загружаемых превью (пусто - прогрев отключен)
+PREVIEW_CACHE_CHAT_ID = os.getenv('PREVIEW_CACHE_CHAT_ID')
+PREVIEW_WARMUP_INTERVAL = float(os.getenv('PREVIEW_WARMUP_INTERVAL', '900'))
+
+def template_name(template_id: int) -> Optional[str]:
+    """Название шаблона для админ-отчетов"""
+    template = template_manager.get_template_by_id(template_id)
+    return template["name"] if template else None
+
+def template_card(locale: str, template) -> tuple:
+    """Подпись и кнопки карточки шаблона в списке"""
+    keyboard = [
+        [
+            catalog.button(locale, 'btn.view', f'view_{template["id"]}'),
+            catalog.button(locale, 'btn.select', f'select_{template["id"]}'),
+        ],
+        [
+            catalog.button(locale, 'btn.price', f'price_{template["id"]}', price=format_price(template["price"])),
         ]
-    
-    def get_templates(self) -> List[Dict]:
-        return self.templates
-    
-    def get_template_by_id(self, template_id: int) -> Optional[Dict]:
-        return next((t for t in self.templates if t["id"] == template_id), None)
+    ]
+    caption = catalog.get(
+        locale, 'templates.card',
+        name=template['name'],
+        category=template['category'],
+        features=', '.join(template['features']),
+        price=format_price(template['price']),
+        description=template['description']
+    )
+    return caption, InlineKeyboardMarkup(keyboard)
 
-template_manager = TemplateManager()
+def template_details(locale: str, template) -> tuple:
+    """Подпись и кнопки подробного просмотра шаблона"""
+    template_id = template['id']
+    keyboard = [
+        [
+            catalog.button(locale, 'btn.select_this', f'select_{template_id}'),
+            catalog.button(locale, 'btn.order_template', f'order_{template_id}'),
+        ],
+        [
+            catalog.button(locale, 'btn.back_to_templates', 'templates'),
+            catalog.button(locale, 'btn.home', 'back_to_main'),
+        ]
+    ]
+    caption = catalog.get(
+        locale, 'templates.details',
+        name=template['name'],
+        category=template['category'],
+        price=format_price(template['price']),
+        features='\n'.join('• ' + feature for feature in template['features']),
+        description=template['description']
+    )
+    return caption, InlineKeyboardMarkup(keyboard)
 
 class UserManager:
     """Менеджер пользователей"""
     
     def __init__(self):
-        self.users = {}
+        self.users: Dict[int, UserRecord] = {}
     
     def add_user(self, user_id: int, user_data: Dict):
-        self.users[user_id] = {
-            "id": user_id,
-            "created_at": datetime.now(),
-            "last_activity": datetime.now(),
-            "selected_template": None,
-            "customization_data": {},
-            "orders": [],
-            **user_data
-        }
+        with span('store users.add'):
+            self.users[user_id] = UserRecord(user_id, **user_data)
     
-    def get_user(self, user_id: int) -> Optional[Dict]:
+    def get_user(self, user_id: int) -> Optional[UserRecord]:
         return self.users.get(user_id)
     
     def update_user(self, user_id: int, data: Dict):
-        if user_id in self.users:
-            self.users[user_id].update(data)
-            self.users[user_id]["last_activity"] = datetime.now()
+        with span('store users.update'):
+            user = self.users.get(user_id)
+            if user is not None:
+                user.update(data)
+                user.touch()
+    
+    def touch_user(self, user_id: int):
+        """Отметка активности, чтобы user_prune не удалил того, кто давно не нажимал /start"""
+        user = self.users.get(user_id)
+        if user is not None:
+            user.touch()
     
     def get_user_stats(self) -> Dict:
         total_users = len(self.users)
-        active_users = len([u for u in self.users.values() 
-                          if (datetime.now() - u["last_activity"]).days < 7])
+        active_since = epoch() - ACTIVE_USER_WINDOW
+        active_users = sum(1 for u in self.users.values() if u.last_activity > active_since)
         return {"total": total_users, "active": active_users}
+    
+    async def prune(self, max_idle: int) -> int:
+        """Удаление неактивных пользователей частями, не блокируя event loop надолго"""
+        cutoff = epoch() - max_idle
+        user_ids = list(self.users)
+        removed = 0
+        for start in range(0, len(user_ids), USER_PRUNE_CHUNK):
+            for user_id in user_ids[start:start + USER_PRUNE_CHUNK]:
+                user = self.users.get(user_id)
+                if user is not None and user.last_activity < cutoff:
+                    del self.users[user_id]
+                    removed += 1
+            await asyncio.sleep(0)
+        if removed:
+            logger.info(f"Удалено неактивных пользователей: {removed}")
+        return removed
 
 user_manager = UserManager()
 
+async def track_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обновление last_activity на каждом апдейте, прошедшем антиспам"""
+    if update.effective_user is not None:
+        user_manager.touch_user(update.effective_user.id)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начало диалога"""
     user = update.effective_user
+    locale = get_locale(update)
+    
+    # Кампания из ссылки t.me/ProThemesRUBot?start=<кампания>, ее записывает track_update
+    campaign = campaign_from_args(context.args)
+    if campaign:
+        context.campaign = campaign
     
     # Регистрируем пользователя
     user_manager.add_user(user.id, {
@@ -183,391 +239,250 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         "username": user.username
     })
     
-    logger.info(f"Пользователь {user.first_name} (ID: {user.id}) начал диалог")
+    logger.info(f"Пользователь {user.first_name} (ID: {user.id}) начал диалог"
+                + (f" по ссылке кампании {campaign}" if campaign else ""))
     
-    reply_markup = InlineKeyboardMarkup(MAIN_MENU)
     await update.message.reply_text(
-        f"Привет, {user.first_name}! 🌟\n\n"
-        "Я помогу вам создать профессиональный сайт.\n"
-        "Выберите действие:",
-        reply_markup=reply_markup
+        catalog.get(locale, 'start', first_name=user.first_name),
+        reply_markup=catalog.keyboard(locale, MAIN_MENU),
+        parse_mode=ParseMode.HTML
     )
     return SELECTING_ACTION
 
+@deferred_answer
 async def show_templates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показать доступные шаблоны"""
     query = update.callback_query
-    await query.answer()
-    
-    templates = template_manager.get_templates()
+    locale = get_locale(update)
     
+    # Один снимок каталога на весь обработчик, даже если он обновится во время отправки
+    templates = template_manager.snapshot
+
     if not templates:
-        await query.message.reply_text("❌ Произошла ошибка при загрузке шаблонов")
+        await query.message.reply_text(catalog.get(locale, 'templates.load_error'))
         return SELECTING_ACTION
-    
-    # Показываем первые 3 шаблона
-    for template in templates[:3]:
-        keyboard = [
-            [
-                InlineKeyboardButton("👁️ Просмотр", callback_data=f'view_{template["id"]}'),
-                InlineKeyboardButton("✅ Выбрать", callback_data=f'select_{template["id"]}'),
-            ],
-            [
-                InlineKeyboardButton("💰 Цена: " + template["price"], callback_data=f'price_{template["id"]}'),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        caption = (
-            f"🎨 <b>{template['name']}</b>\n"
-            f"📂 Категория: {template['category']}\n"
-            f"✨ Особенности: {', '.join(template['features'])}\n"
-            f"💵 Цена: {template['price']}\n\n"
-            f"📝 {template['description']}"
-        )
-        
-        await query.message.reply_photo(
-            photo=template["preview_image"],
-            caption=caption,
-            reply_markup=reply_markup,
+
+    # Показываем первые 3 шаблона по порядку каталога: одновременные отправки
+    # приходят в чат в случайном порядке, поэтому карточки идут одна за другой
+    for template in templates.page(0, TEMPLATES_PAGE_SIZE):
+        card = templates.cached(('card', locale, template['id']), lambda: template_card(locale, template))
+        sent = await query.message.reply_photo(
+            photo=templates.photo(template),
+            caption=card[0],
+            reply_markup=card[1],
             parse_mode=ParseMode.HTML
         )
-    
+        # file_id сохраняется сразу, даже если следующая карточка не отправится
+        templates.remember_photo(template['id'], sent)
+
+    # Кнопки отправляются после карточек, чтобы оказаться под ними
     # Кнопка "Показать еще"
-    if len(templates) > 3:
-        keyboard = [
-            [InlineKeyboardButton("📄 Показать еще", callback_data='more_templates')],
-            [InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    if len(templates) > TEMPLATES_PAGE_SIZE:
         await query.message.reply_text(
-            "Показаны первые 3 шаблона. Хотите увидеть остальные?",
-            reply_markup=reply_markup
+            catalog.get(locale, 'templates.more'),
+            reply_markup=catalog.keyboard(locale, MORE_TEMPLATES_MENU)
         )
     else:
-        keyboard = [[InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await query.message.reply_text(
-            "Это все доступные шаблоны. Выберите подходящий!",
-            reply_markup=reply_markup
+            catalog.get(locale, 'templates.all_shown'),
+            reply_markup=catalog.keyboard(locale, BACK_TO_MAIN_MENU)
         )
     
     return TEMPLATES
 
+@deferred_answer
 async def view_template(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Детальный просмотр шаблона"""
     query = update.callback_query
-    await query.answer()
+    locale = get_locale(update)
     
     template_id = int(query.data.split('_')[1])
-    template = template_manager.get_template_by_id(template_id)
-    
+    templates = template_manager.snapshot
+    template = templates.get(template_id)
+
     if not template:
-        await query.message.reply_text("❌ Шаблон не найден")
+        toast(context, catalog.get(locale, 'templates.not_found'), show_alert=True)
         return TEMPLATES
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Выбрать этот шаблон", callback_data=f'select_{template_id}'),
-            InlineKeyboardButton("💰 Заказать", callback_data=f'order_{template_id}'),
-        ],
-        [
-            InlineKeyboardButton("🔙 Назад к шаблонам", callback_data='templates'),
-            InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main'),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    detailed_caption = (
-        f"🎨 <b>{template['name']}</b>\n\n"
-        f"📂 <b>Категория:</b> {template['category']}\n"
-        f"💵 <b>Цена:</b> {template['price']}\n\n"
-        f"✨ <b>Особенности:</b>\n"
-        f"{chr(10).join(['• ' + feature for feature in template['features']])}\n\n"
-        f"📝 <b>Описание:</b>\n{template['description']}\n\n"
-        f"🚀 <b>Что включено:</b>\n"
-        f"• Адаптивный дизайн\n"
-        f"• SEO-оптимизация\n"
-        f"• Техническая поддержка\n"
-        f"• Обучение работе с сайтом"
-    )
-    
-    await query.message.reply_photo(
-        photo=template["preview_image"],
-        caption=detailed_caption,
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.HTML
+
+    details = templates.cached(('details', locale, template_id), lambda: template_details(locale, template))
+    sent = await show_screen(
+        update, context,
+        details[0],
+        reply_markup=details[1],
+        parse_mode=ParseMode.HTML,
+        photo=templates.photo(template)
     )
-    
+    templates.remember_photo(template_id, sent)
+
     return TEMPLATES
 
+@deferred_answer
 async def customize_template(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Конструктор сайта"""
-    query = update.callback_query
-    await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("🎨 Цветовая схема", callback_data='customize_colors'),
-            InlineKeyboardButton("📝 Контент", callback_data='customize_content'),
-        ],
-        [
-            InlineKeyboardButton("🖼️ Изображения", callback_data='customize_images'),
-            InlineKeyboardButton("🔤 Шрифты", callback_data='customize_fonts'),
-        ],
-        [
-            InlineKeyboardButton("📱 Адаптивность", callback_data='customize_responsive'),
-            InlineKeyboardButton("⚡ Анимации", callback_data='customize_animations'),
-        ],
-        [
-            InlineKeyboardButton("👁️ Предпросмотр", callback_data='preview_site'),
-            InlineKeyboardButton("💾 Сохранить", callback_data='save_customization'),
-        ],
-        [
-            InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main'),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    locale = get_locale(update)
     
-    await query.message.reply_text(
-        "🎨 <b>Конструктор сайта</b>\n\n"
-        "Выберите, что хотите настроить:\n\n"
-        "• <b>Цветовая схема</b> - измените цвета сайта\n"
-        "• <b>Контент</b> - отредактируйте тексты и блоки\n"
-        "• <b>Изображения</b> - загрузите свои фото\n"
-        "• <b>Шрифты</b> - выберите стиль текста\n"
-        "• <b>Адаптивность</b> - настройте для мобильных\n"
-        "• <b>Анимации</b> - добавьте эффекты\n\n"
-        "После настройки можете предварительно просмотреть результат!",
-        reply_markup=reply_markup,
+    await show_screen(
+        update, context,
+        catalog.get(locale, 'customization'),
+        reply_markup=catalog.keyboard(locale, CUSTOMIZATION_MENU),
         parse_mode=ParseMode.HTML
     )
     return CUSTOMIZATION
 
+@deferred_answer
 async def order_website(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Заказ сайта"""
-    query = update.callback_query
-    await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("🚀 Базовый (5000₽)", callback_data='order_basic'),
-            InlineKeyboardButton("⭐ Про (8000₽)", callback_data='order_pro'),
-        ],
-        [
-            InlineKeyboardButton("💎 Премиум (15000₽)", callback_data='order_premium'),
-            InlineKeyboardButton("🏢 Корпоративный (25000₽)", callback_data='order_corporate'),
-        ],
-        [
-            InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main'),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    locale = get_locale(update)
     
-    await query.message.reply_text(
-        "📦 <b>Выберите тарифный план:</b>\n\n"
-        "🚀 <b>Базовый (5000₽)</b>\n"
-        "• 1-2 страницы\n"
-        "• Адаптивный дизайн\n"
-        "• Базовая SEO-оптимизация\n"
-        "• Срок: 3-5 дней\n\n"
-        "⭐ <b>Про (8000₽)</b>\n"
-        "• 3-5 страниц\n"
-        "• Продвинутый дизайн\n"
-        "• Формы обратной связи\n"
-        "• Срок: 5-7 дней\n\n"
-        "💎 <b>Премиум (15000₽)</b>\n"
-        "• 5-10 страниц\n"
-        "• Уникальный дизайн\n"
-        "• Анимации и эффекты\n"
-        "• Срок: 7-10 дней\n\n"
-        "🏢 <b>Корпоративный (25000₽)</b>\n"
-        "• Неограниченное количество страниц\n"
-        "• Полная кастомизация\n"
-        "• Техническая поддержка 24/7\n"
-        "• Срок: 10-14 дней",
-        reply_markup=reply_markup,
+    await show_screen(
+        update, context,
+        catalog.get(locale, 'order'),
+        reply_markup=catalog.keyboard(locale, ORDER_MENU),
         parse_mode=ParseMode.HTML
     )
     return ORDER
 
+@deferred_answer
 async def show_pricing(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показать цены"""
-    query = update.callback_query
-    await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📦 Заказать", callback_data='order'),
-            InlineKeyboardButton("💬 Консультация", callback_data='consultation'),
-        ],
-        [
-            InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main'),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    locale = get_locale(update)
     
-    await query.message.reply_text(
-        "💰 <b>Наши цены</b>\n\n"
-        "🚀 <b>Базовый пакет - 5000₽</b>\n"
-        "• Лендинг-страница\n"
-        "• Адаптивный дизайн\n"
-        "• Базовая SEO-оптимизация\n"
-        "• 1 месяц поддержки\n\n"
-        "⭐ <b>Про пакет - 8000₽</b>\n"
-        "• Многостраничный сайт\n"
-        "• Продвинутый дизайн\n"
-        "• Формы обратной связи\n"
-        "• 3 месяца поддержки\n\n"
-        "💎 <b>Премиум пакет - 15000₽</b>\n"
-        "• Полнофункциональный сайт\n"
-        "• Уникальный дизайн\n"
-        "• Анимации и эффекты\n"
-        "• 6 месяцев поддержки\n\n"
-        "🏢 <b>Корпоративный - от 25000₽</b>\n"
-        "• Индивидуальная разработка\n"
-        "• Полная кастомизация\n"
-        "• Техподдержка 24/7\n"
-        "• 12 месяцев поддержки\n\n"
-        "💡 <b>Дополнительные услуги:</b>\n"
-        "• SEO-продвижение: от 5000₽/мес\n"
-        "• Техподдержка: от 2000₽/мес\n"
-        "• Обновления: от 1000₽/мес",
-        reply_markup=reply_markup,
+    await show_screen(
+        update, context,
+        catalog.get(locale, 'pricing'),
+        reply_markup=catalog.keyboard(locale, PRICING_MENU),
         parse_mode=ParseMode.HTML
     )
     return SELECTING_ACTION
 
+@deferred_answer
 async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показать помощь"""
-    query = update.callback_query
-    await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📞 Связаться с поддержкой", callback_data='support'),
-            InlineKeyboardButton("📧 Написать на email", callback_data='email_support'),
-        ],
-        [
-            InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main'),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    locale = get_locale(update)
     
-    await query.message.reply_text(
-        "❓ <b>Помощь и поддержка</b>\n\n"
-        "🤖 <b>Как пользоваться ботом:</b>\n"
-        "1. Выберите шаблон из каталога\n"
-        "2. Настройте его под свои нужды\n"
-        "3. Закажите разработку\n"
-        "4. Получите готовый сайт\n\n"
-        "📞 <b>Связаться с нами:</b>\n"
-        "• Telegram: @prothemes_support\n"
-        "• Email: support@prothemes.ru\n"
-        "• Телефон: +7 (999) 123-45-67\n\n"
-        "⏰ <b>Время работы:</b>\n"
-        "Пн-Пт: 9:00 - 18:00 (МСК)\n"
-        "Сб-Вс: 10:00 - 16:00 (МСК)\n\n"
-        "💡 <b>Часто задаваемые вопросы:</b>\n"
-        "• Сколько времени занимает разработка?\n"
-        "• Можно ли изменить дизайн после оплаты?\n"
-        "• Предоставляете ли вы хостинг?\n"
-        "• Есть ли гарантия на работу сайта?",
-        reply_markup=reply_markup,
+    await show_screen(
+        update, context,
+        catalog.get(locale, 'help'),
+        reply_markup=catalog.keyboard(locale, HELP_MENU),
         parse_mode=ParseMode.HTML
     )
     return SELECTING_ACTION
 
+@deferred_answer
 async def show_contacts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показать контакты"""
-    query = update.callback_query
-    await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📞 Позвонить", callback_data='call_us'),
-            InlineKeyboardButton("💬 Написать в Telegram", callback_data='telegram_contact'),
-        ],
-        [
-            InlineKeyboardButton("📧 Email", callback_data='email_contact'),
-            InlineKeyboardButton("🌐 Наш сайт", callback_data='website'),
-        ],
-        [
-            InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main'),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    locale = get_locale(update)
     
-    await query.message.reply_text(
-        "📞 <b>Наши контакты</b>\n\n"
-        "🏢 <b>ProThemesRU</b>\n"
-        "Создание профессиональных сайтов\n\n"
-        "📱 <b>Telegram:</b> @prothemes_support\n"
-        "📧 <b>Email:</b> info@prothemes.ru\n"
-        "📞 <b>Телефон:</b> +7 (999) 123-45-67\n"
-        "🌐 <b>Сайт:</b> https://prothemes.ru\n\n"
-        "📍 <b>Адрес:</b>\n"
-        "г. Москва, ул. Примерная, д. 123\n"
-        "Бизнес-центр 'Технопарк'\n\n"
-        "⏰ <b>Время работы:</b>\n"
-        "Понедельник - Пятница: 9:00 - 18:00\n"
-        "Суббота: 10:00 - 16:00\n"
-        "Воскресенье: выходной\n\n"
-        "💬 <b>Онлайн-консультации:</b>\n"
-        "Круглосуточно через бота",
-        reply_markup=reply_markup,
+    await show_screen(
+        update, context,
+        catalog.get(locale, 'contacts'),
+        reply_markup=catalog.keyboard(locale, CONTACTS_MENU),
         parse_mode=ParseMode.HTML
     )
     return SELECTING_ACTION
 
+@deferred_answer
 async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Возврат в главное меню"""
-    query = update.callback_query
-    await query.answer()
+    locale = get_locale(update)
     
-    reply_markup = InlineKeyboardMarkup(MAIN_MENU)
-    await query.message.reply_text(
-        "🏠 <b>Главное меню</b>\n\n"
-        "Выберите действие:",
-        reply_markup=reply_markup,
+    await show_screen(
+        update, context,
+        catalog.get(locale, 'main_menu'),
+        reply_markup=catalog.keyboard(locale, MAIN_MENU),
         parse_mode=ParseMode.HTML
     )
     return SELECTING_ACTION
 
+@deferred_answer
+async def contact_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Кнопки связи на экранах цен, помощи и контактов: контакты во всплывающем окне"""
+    toast(context, catalog.get(get_locale(update), 'contacts.alert'), show_alert=True)
+    return SELECTING_ACTION
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок"""
     logger.error(msg="Ошибка:", exc_info=context.error)
     
-    if isinstance(update, Update):
-        await update.effective_message.reply_text(
-            "❌ Произошла ошибка. Пожалуйста, попробуйте снова или обратитесь в поддержку."
-        )
+    if isinstance(update, Update) and update.effective_message:
+        # При сбое Bot API сообщение об ошибке отбрасывается, а не порождает новую ошибку
+        with non_critical():
+            try:
+                await update.effective_message.reply_text(catalog.get(get_locale(update), 'error'))
+            except TelegramError as e:
+                logger.warning(f"Не удалось сообщить пользователю об ошибке: {e}")
 
-async def send_admin_notification(message: str):
+async def send_admin_notification(bot: Bot, message: str):
     """Отправка уведомления администратору"""
     if ADMIN_CHAT_ID:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage",
-                    json={
-                        "chat_id": ADMIN_CHAT_ID,
-                        "text": f"🔔 {message}",
-                        "parse_mode": "HTML"
-                    }
-                ) as response:
-                    if response.status != 200:
-                        logger.error(f"Ошибка отправки уведомления админу: {response.status}")
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления админу: {e}")
+        with non_critical():
+            try:
+                await bot.send_message(
+                    chat_id=ADMIN_CHAT_ID,
+                    text=f"🔔 {message}",
+                    parse_mode=ParseMode.HTML
+                )
+            except TelegramError as e:
+                logger.error(f"Ошибка отправки уведомления админу: {e}")
 
-def main() -> None:
-    """Запуск бота"""
-    if not TELEGRAM_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN не установлен!")
-        return
+async def warm_up_previews(bot: Bot):
+    """Загрузка превью в служебный чат, чтобы первый показ каталога шел по file_id"""
+    templates = template_manager.snapshot
+    for template in templates.templates:
+        if template.id in templates.file_ids:
+            continue
+        with non_critical():
+            try:
+                message = await bot.send_photo(
+                    chat_id=PREVIEW_CACHE_CHAT_ID,
+                    photo=template.preview_image,
+                    disable_notification=True
+                )
+            except TelegramError as e:
+                logger.warning(f"Превью шаблона {template.id} не загружено: {e}")
+                continue
+            templates.remember_photo(template.id, message)
+            try:
+                await message.delete()
+            except TelegramError:
+                pass
+
+async def post_init(application: Application) -> None:
+    """Запуск фоновых задач"""
+    await event_tracker.start()
+    scheduler.add('analytics_flush', event_tracker.flush, event_tracker.flush_interval)
+    scheduler.add('catalog_refresh', template_manager.refresh, template_manager.check_interval)
+    if tracer.enabled and tracer.path:
+        scheduler.add('trace_export', tracer.export, TRACE_EXPORT_INTERVAL)
+    scheduler.add('user_prune', lambda: user_manager.prune(USER_RETENTION_DAYS * 24 * 3600),
+                  USER_PRUNE_INTERVAL)
+    if PREVIEW_CACHE_CHAT_ID:
+        scheduler.add('preview_warmup', lambda: warm_up_previews(application.bot),
+                      PREVIEW_WARMUP_INTERVAL, first_delay=5)
+    await scheduler.start(application)
+
+async def post_shutdown(application: Application) -> None:
+    """Остановка фоновых задач"""
+    await scheduler.stop()
+    await event_tracker.stop()
+    await tracer.export()
+
+def build_application() -> Application:
+    """Приложение со всеми обработчиками (используется и воркерами шардов)"""
+    application = (
+        Application.builder()
+        .application_class(TracingApplication)
+        .token(TELEGRAM_TOKEN)
+        .request(ResilientRequest())
+        .base_url(BOT_API_URL)
+        .base_file_url(BOT_API_FILE_URL)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Антиспам срабатывает раньше всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, throttle_middleware), group=-1)
     
     # Добавляем обработчики
     conv_handler = ConversationHandler(
@@ -580,6 +495,9 @@ def main() -> None:
                 CallbackQueryHandler(show_pricing, pattern='^pricing$'),
                 CallbackQueryHandler(show_help, pattern='^help$'),
                 CallbackQueryHandler(show_contacts, pattern='^contacts$'),
+                # Экраны цен, помощи и контактов заменяют меню и остаются в этом состоянии
+                CallbackQueryHandler(back_to_main, pattern='^back_to_main$'),
+                CallbackQueryHandler(contact_request, pattern=CONTACT_BUTTONS_PATTERN),
             ],
             TEMPLATES: [
                 CallbackQueryHandler(view_template, pattern='^view_\d+$'),
@@ -599,11 +517,39 @@ def main() -> None:
     )
     
     application.add_handler(conv_handler)
+    
+    # Админ-команды и замер времени обработки
+    register_admin_handlers(application, template_name=template_name,
+                            reload_templates=template_manager.reload)
+    
+    # Аналитика видит только апдейты, прошедшие антиспам
+    application.add_handler(TypeHandler(Update, track_update), group=1)
+    # Активность пользователей для user_prune (группа 2 занята замером времени)
+    application.add_handler(TypeHandler(Update, track_user_activity), group=USER_ACTIVITY_GROUP)
     application.add_error_handler(error_handler)
     
-    # Запуск бота
+    # Участки трассы для обработчиков (только при TRACE_SAMPLE_RATE > 0)
+    instrument(application)
+    
+    return application
+
+def main() -> None:
+    """Запуск бота"""
+    if not TELEGRAM_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN не установлен!")
+        return
+    
+    # При BOT_WORKERS > 1 этот процесс только принимает апдейты и раздает их воркерам
+    if BOT_WORKERS > 1:
+        application = ShardedDispatcher(build_application, BOT_WORKERS).build_ingress(TELEGRAM_TOKEN)
+        allowed_updates = allowed_updates_for(build_application())
+    else:
+        application = build_application()
+        allowed_updates = allowed_updates_for(application)
+    
+    # Запуск бота: запрашиваются только типы апдейтов, которые есть в обработчиках
     logger.info("Запуск телеграм бота...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    run_polling(application, allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
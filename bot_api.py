@@ -0,0 +1,267 @@
+"""
+ProThemesRU Telegram Bot - Resilient Bot API client
+Pooled HTTP transport for python-telegram-bot with jittered retries,
+hedged reads, a circuit breaker that sheds non-critical sends and
+per-method latency and error stats
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import httpx
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest, RequestData
+
+from admin import admin_stats
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Адрес Bot API (можно направить на локальный сервер или заглушку с отказами)
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org')
+BOT_API_URL = f"{BOT_API_BASE_URL}/bot"
+BOT_API_FILE_URL = f"{BOT_API_BASE_URL}/file/bot"
+
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '16'))
+BOT_API_MAX_RETRIES = int(os.getenv('BOT_API_MAX_RETRIES', '3'))
+BOT_API_BACKOFF_BASE = float(os.getenv('BOT_API_BACKOFF_BASE', '0.3'))
+BOT_API_BACKOFF_MAX = float(os.getenv('BOT_API_BACKOFF_MAX', '5'))
+# Дольше этого ждать по 429 не будем - ошибка уходит в обработчик
+BOT_API_RETRY_AFTER_MAX = float(os.getenv('BOT_API_RETRY_AFTER_MAX', '5'))
+# Через сколько секунд без ответа дублировать идемпотентный запрос (0 - не дублировать)
+BOT_API_HEDGE_DELAY = float(os.getenv('BOT_API_HEDGE_DELAY', '1.0'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+# Методы, повтор которых не создает дублей у пользователя
+IDEMPOTENT_METHODS = {
+    'answerCallbackQuery', 'editMessageText', 'editMessageMedia', 'editMessageCaption',
+    'editMessageReplyMarkup', 'deleteMessage', 'sendChatAction',
+    'setWebhook', 'deleteWebhook', 'setMyCommands',
+}
+# Чтения, которые можно дублировать при медленном ответе
+HEDGED_METHODS = {'getMe', 'getChat', 'getChatMember', 'getFile', 'getWebhookInfo', 'getMyCommands'}
+# Всегда второстепенные методы
+NON_CRITICAL_METHODS = {'sendChatAction'}
+
+# Ответы, при которых запрос заведомо не дошел до Telegram
+# (504 сюда не входит: шлюз мог передать запрос и не дождаться ответа)
+UNAVAILABLE_STATUSES = {502, 503}
+# Ошибки транспорта, при которых запрос не был отправлен
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_non_critical = contextvars.ContextVar('bot_api_non_critical', default=False)
+
+
+@contextmanager
+def non_critical():
+    """Запросы внутри блока отбрасываются, пока Bot API недоступен"""
+    token = _non_critical.set(True)
+    try:
+        yield
+    finally:
+        _non_critical.reset(token)
+
+
+def is_idempotent(endpoint: str) -> bool:
+    return endpoint.startswith('get') or endpoint in IDEMPOTENT_METHODS
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(BOT_API_BACKOFF_MAX, BOT_API_BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Предохранитель: после серии отказов второстепенные запросы не отправляются"""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        # Время ожидания вышло: следующий запрос проверит, восстановился ли API
+        return 'half_open'
+
+    def allow(self, critical: bool) -> bool:
+        return critical or self.state != 'open'
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Bot API снова доступен, предохранитель закрыт")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.times_opened += 1
+                logger.warning(f"Bot API недоступен ({self.failures} отказов подряд), "
+                               f"второстепенные запросы отбрасываются {self.reset_timeout:.0f} с")
+            self.opened_at = time.monotonic()
+
+
+class BotApiStats:
+    """Счетчики по методам Bot API; время ответа пишется в admin_stats (маршруты api:*)"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, Dict[str, int]] = {}
+
+    def count(self, endpoint: str, counter: str):
+        counters = self.endpoints.get(endpoint)
+        if counters is None:
+            counters = self.endpoints[endpoint] = {
+                "calls": 0, "errors": 0, "retries": 0, "shed": 0, "hedged": 0
+            }
+        counters[counter] += 1
+
+    def record(self, endpoint: str, seconds: float, error: bool = False):
+        self.count(endpoint, 'calls')
+        if error:
+            self.count(endpoint, 'errors')
+        admin_stats.record_latency(f"api:{endpoint}", seconds)
+
+    def get_stats(self) -> Dict:
+        result = {}
+        for endpoint, counters in sorted(self.endpoints.items()):
+            histogram = admin_stats.latency.get(f"api:{endpoint}")
+            result[endpoint] = {
+                **counters,
+                "error_rate": round(counters["errors"] / counters["calls"], 3) if counters["calls"] else 0.0,
+                "p50_ms": round(histogram.percentile(0.5) * 1000, 1) if histogram else None,
+                "p95_ms": round(histogram.percentile(0.95) * 1000, 1) if histogram else None,
+            }
+        return result
+
+
+circuit_breaker = CircuitBreaker()
+api_stats = BotApiStats()
+
+
+class ResilientRequest(HTTPXRequest):
+    """HTTPXRequest с пулом соединений, повторами, дублированием чтений и предохранителем"""
+
+    def __init__(self, connection_pool_size: int = BOT_API_POOL_SIZE,
+                 max_retries: int = BOT_API_MAX_RETRIES, hedge_delay: float = BOT_API_HEDGE_DELAY,
+                 breaker: CircuitBreaker = circuit_breaker, stats: BotApiStats = api_stats, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker
+        self.stats = stats
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         **timeouts) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        with span(f"bot_api {endpoint}", **{"rpc.system": "telegram", "rpc.method": endpoint}) as api_span:
+            status, payload = await self._request(endpoint, url, method, request_data, timeouts)
+            if api_span is not None:
+                api_span.attributes["http.status_code"] = status
+            return status, payload
+
+    async def _request(self, endpoint: str, url: str, method: str,
+                       request_data: Optional[RequestData], timeouts: Dict) -> Tuple[int, bytes]:
+        """Запрос с повторами и проверкой предохранителя"""
+        critical = endpoint not in NON_CRITICAL_METHODS and not _non_critical.get()
+        if not self.breaker.allow(critical):
+            self.stats.count(endpoint, 'shed')
+            raise NetworkError(f"Bot API недоступен, {endpoint} не отправлен")
+
+        # При открытом предохранителе важные запросы идут без повторов - это проверка API
+        attempts = 1 if self.breaker.state == 'open' else self.max_retries + 1
+        for attempt in range(attempts):
+            last_attempt = attempt + 1 == attempts
+            started = time.perf_counter()
+            try:
+                status, payload = await self._send(endpoint, url, method, request_data, timeouts)
+            except NetworkError as e:
+                self.stats.record(endpoint, time.perf_counter() - started, error=True)
+                self.breaker.record_failure()
+                not_sent = isinstance(e.__cause__, NOT_SENT_ERRORS)
+                if last_attempt or not (not_sent or is_idempotent(endpoint)):
+                    raise
+                delay = backoff_delay(attempt)
+            else:
+                elapsed = time.perf_counter() - started
+                if status == 429:
+                    # Ограничение частоты - не отказ API, предохранитель не трогаем
+                    self.stats.record(endpoint, elapsed, error=True)
+                    retry_after = self._retry_after(payload)
+                    if last_attempt or retry_after is None or retry_after > BOT_API_RETRY_AFTER_MAX:
+                        return status, payload
+                    delay = retry_after
+                elif status >= 500:
+                    self.stats.record(endpoint, elapsed, error=True)
+                    self.breaker.record_failure()
+                    # Отправку с 500 повторять нельзя: сообщение могло дойти до пользователя
+                    retryable = status in UNAVAILABLE_STATUSES or is_idempotent(endpoint)
+                    if last_attempt or not retryable:
+                        return status, payload
+                    delay = backoff_delay(attempt)
+                else:
+                    # 4xx - ошибка запроса, а не API: для предохранителя это успешный ответ
+                    self.stats.record(endpoint, elapsed, error=status >= 400)
+                    self.breaker.record_success()
+                    return status, payload
+
+            self.stats.count(endpoint, 'retries')
+            await asyncio.sleep(delay)
+
+    async def _send(self, endpoint: str, url: str, method: str,
+                    request_data: Optional[RequestData], timeouts: Dict) -> Tuple[int, bytes]:
+        """Один запрос; медленное чтение дублируется, побеждает первый успешный ответ"""
+        send = super().do_request
+        if endpoint not in HEDGED_METHODS or not self.hedge_delay:
+            return await send(url, method, request_data, **timeouts)
+
+        first = asyncio.ensure_future(send(url, method, request_data, **timeouts))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done:
+            return first.result()
+
+        self.stats.count(endpoint, 'hedged')
+        second = asyncio.ensure_future(send(url, method, request_data, **timeouts))
+        error: Optional[BaseException] = None
+        try:
+            for future in asyncio.as_completed((first, second)):
+                try:
+                    return await future
+                except NetworkError as e:
+                    error = e
+            raise error
+        finally:
+            first.cancel()
+            second.cancel()
+
+    @staticmethod
+    def _retry_after(payload: bytes) -> Optional[float]:
+        try:
+            return float(json.loads(payload)['parameters']['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+def get_stats() -> Dict:
+    """Состояние клиента для /status"""
+    return {
+        "circuit": circuit_breaker.state,
+        "circuit_opened": circuit_breaker.times_opened,
+        "endpoints": api_stats.get_stats(),
+    }
@@ -0,0 +1,124 @@
+"""
+ProThemesRU Telegram Bot - Localized message catalog
+Per-locale bundles are loaded once and compiled into HTML formatters
+"""
+
+import os
+import json
+import html
+import logging
+from string import Formatter
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+DEFAULT_LOCALE = os.getenv('DEFAULT_LOCALE', 'ru')
+
+# Раскладка клавиатуры: строки из пар (ключ подписи, callback_data)
+KeyboardLayout = Tuple[Tuple[Tuple[str, str], ...], ...]
+Message = Union[str, Callable[..., str]]
+
+
+def _compile(text: str) -> Message:
+    """Статический текст остается строкой, шаблон с полями - форматтером"""
+    if not any(field for _, field, _, _ in Formatter().parse(text)):
+        # Экранированные скобки {{ }} раскрываем один раз при загрузке
+        return text.format()
+
+    def render(**kwargs) -> str:
+        return text.format_map({key: html.escape(str(value)) for key, value in kwargs.items()})
+
+    return render
+
+
+class MessageCatalog:
+    """Каталог сообщений с предкомпилированными шаблонами по локалям"""
+
+    def __init__(self, locales_dir: str = LOCALES_DIR, default_locale: str = DEFAULT_LOCALE):
+        self.default_locale = default_locale
+        self.bundles: Dict[str, Dict[str, Message]] = self._load_bundles(locales_dir)
+        self._locale_cache: Dict[Optional[str], str] = {}
+        self._keyboards: Dict[Tuple[str, KeyboardLayout], InlineKeyboardMarkup] = {}
+
+        if self.default_locale not in self.bundles:
+            raise ValueError(f"Нет каталога сообщений для локали по умолчанию: {self.default_locale}")
+
+    def _load_bundles(self, locales_dir: str) -> Dict[str, Dict[str, Message]]:
+        """Загрузка и компиляция всех JSON-каталогов"""
+        bundles = {}
+        for filename in sorted(os.listdir(locales_dir)):
+            locale, ext = os.path.splitext(filename)
+            if ext != '.json':
+                continue
+            with open(os.path.join(locales_dir, filename), 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            bundles[locale] = {
+                key: _compile('\n'.join(value) if isinstance(value, list) else value)
+                for key, value in raw.items()
+            }
+
+        # Недостающие ключи берем из локали по умолчанию при загрузке, а не на каждом апдейте
+        default = bundles.get(self.default_locale, {})
+        for locale, bundle in bundles.items():
+            missing = default.keys() - bundle.keys()
+            if missing and locale != self.default_locale:
+                logger.warning(f"В локали {locale} нет {len(missing)} сообщений, используем {self.default_locale}")
+                for key in missing:
+                    bundle[key] = default[key]
+
+        logger.info(f"Загружены локали: {', '.join(bundles)}")
+        return bundles
+
+    def resolve_locale(self, language_code: Optional[str]) -> str:
+        """Выбор локали по language_code пользователя ('en-US' -> 'en')"""
+        locale = self._locale_cache.get(language_code)
+        if locale is None:
+            locale = self.default_locale
+            if language_code:
+                code = language_code.lower().replace('_', '-')
+                for candidate in (code, code.split('-')[0]):
+                    if candidate in self.bundles:
+                        locale = candidate
+                        break
+            self._locale_cache[language_code] = locale
+        return locale
+
+    def get(self, locale: str, key: str, **kwargs) -> str:
+        """Текст сообщения; параметры экранируются для ParseMode.HTML"""
+        message = self.bundles[locale][key]
+        if isinstance(message, str):
+            return message
+        return message(**kwargs)
+
+    def keyboard(self, locale: str, layout: KeyboardLayout) -> InlineKeyboardMarkup:
+        """Статическая клавиатура, собранная один раз на локаль"""
+        cache_key = (locale, layout)
+        markup = self._keyboards.get(cache_key)
+        if markup is None:
+            bundle = self.bundles[locale]
+            markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton(bundle[label], callback_data=data) for label, data in row]
+                for row in layout
+            ])
+            self._keyboards[cache_key] = markup
+        return markup
+
+    def button(self, locale: str, key: str, callback_data: str, **kwargs) -> InlineKeyboardButton:
+        return InlineKeyboardButton(self.get(locale, key, **kwargs), callback_data=callback_data)
+
+
+catalog = MessageCatalog()
+
+
+def get_locale(update: Optional[Update]) -> str:
+    """Локаль пользователя, от которого пришел апдейт"""
+    user = update.effective_user if isinstance(update, Update) else None
+    return catalog.resolve_locale(user.language_code if user else None)
+
+
+def layout(*rows: Sequence[Tuple[str, str]]) -> KeyboardLayout:
+    """Неизменяемая раскладка клавиатуры для кэша"""
+    return tuple(tuple(row) for row in rows)
@@ -0,0 +1,151 @@
+"""
+ProThemesRU Telegram Bot - Edit-in-place navigation
+Menu screens replace the current message instead of appending new ones;
+callback queries are acknowledged in parallel with the screen update
+"""
+
+import os
+import asyncio
+import logging
+import functools
+from typing import Any, Awaitable, Callable, Optional
+
+from telegram import CallbackQuery, InlineKeyboardMarkup, InputMediaPhoto, Message, Update
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Режим навигации: редактировать текущее сообщение или отправлять новое
+EDIT_IN_PLACE = os.getenv('EDIT_IN_PLACE_NAVIGATION', 'true').lower() == 'true'
+
+# Ключ в chat_data с последним показанным экраном
+LAST_SCREEN_KEY = '_last_screen'
+
+
+def _screen_key(text: str, reply_markup: Optional[InlineKeyboardMarkup],
+                parse_mode: Optional[str], photo: Optional[str]) -> int:
+    """Отпечаток содержимого экрана"""
+    markup = reply_markup.to_json() if reply_markup is not None else None
+    return hash((text, parse_mode, photo, markup))
+
+
+async def show_screen(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    parse_mode: Optional[str] = None,
+    photo: Optional[str] = None,
+) -> Optional[Message]:
+    """Показать экран, по возможности отредактировав сообщение с кнопкой"""
+    query = update.callback_query
+    message = query.message
+    chat_data = context.chat_data if context.chat_data is not None else {}
+    key = _screen_key(text, reply_markup, parse_mode, photo)
+
+    if EDIT_IN_PLACE and message is not None:
+        # Экран уже показан в этом сообщении - запрос к API не нужен
+        if chat_data.get(LAST_SCREEN_KEY) == (message.message_id, key):
+            return message
+
+        edited = None
+        try:
+            if photo is None and message.text is not None:
+                edited = await query.edit_message_text(
+                    text,
+                    parse_mode=parse_mode,
+                    reply_markup=reply_markup
+                )
+            elif photo is not None and message.photo:
+                edited = await query.edit_message_media(
+                    InputMediaPhoto(photo, caption=text, parse_mode=parse_mode),
+                    reply_markup=reply_markup
+                )
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                chat_data[LAST_SCREEN_KEY] = (message.message_id, key)
+                return message
+            logger.debug(f"Редактирование невозможно, отправляем новое сообщение: {e}")
+
+        if isinstance(edited, Message):
+            chat_data[LAST_SCREEN_KEY] = (edited.message_id, key)
+            return edited
+
+    if message is None:
+        return None
+
+    # Редактирование невозможно: другой тип сообщения или ошибка API
+    if photo is not None:
+        sent = await message.reply_photo(
+            photo=photo,
+            caption=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    else:
+        sent = await message.reply_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    chat_data[LAST_SCREEN_KEY] = (sent.message_id, key)
+    return sent
+
+
+class CallbackAck:
+    """Ответ на нажатие кнопки, который уходит параллельно с работой обработчика"""
+
+    def __init__(self, query: CallbackQuery):
+        self.query = query
+        self.text: Optional[str] = None
+        self.show_alert = False
+        self.sent = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        # Задача стартует на первом await обработчика, вместе с его первым запросом к API
+        self._task = asyncio.create_task(self._answer())
+
+    async def _answer(self):
+        self.sent = True
+        try:
+            await self.query.answer(self.text, show_alert=self.show_alert)
+        except TelegramError as e:
+            logger.debug(f"Не удалось ответить на callback: {e}")
+
+    def toast(self, text: str, show_alert: bool = False) -> bool:
+        """Текст уведомления; работает, пока ответ еще не отправлен"""
+        if self.sent:
+            logger.debug("Callback уже подтвержден, уведомление не показано")
+            return False
+        self.text = text
+        self.show_alert = show_alert
+        return True
+
+    async def wait(self):
+        if self._task is not None:
+            await self._task
+
+
+def deferred_answer(handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+    """Декоратор обработчика кнопки: query.answer() выполняется параллельно с обработчиком.
+
+    Уведомление задается через toast() до первого await обработчика.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        ack = CallbackAck(update.callback_query)
+        context.callback_ack = ack
+        ack.start()
+        try:
+            return await handler(update, context)
+        finally:
+            await ack.wait()
+    return wrapper
+
+
+def toast(context: ContextTypes.DEFAULT_TYPE, text: str, show_alert: bool = False) -> bool:
+    """Показать уведомление (или alert) в ответе на нажатие кнопки"""
+    ack = getattr(context, 'callback_ack', None)
+    return ack.toast(text, show_alert) if ack is not None else False
@@ -0,0 +1,314 @@
+"""
+ProThemesRU Telegram Bot - Long-polling engine
+getUpdates loop that requests only the update types the handlers consume,
+adapts limit and timeout to traffic, prefetches the next batch and
+reports polling lag
+"""
+
+import os
+import re
+import time
+import random
+import signal
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Sequence
+
+from telegram import Update
+from telegram.error import InvalidToken, RetryAfter, TelegramError
+from telegram.ext import (
+    Application,
+    BaseHandler,
+    CallbackQueryHandler,
+    ChatJoinRequestHandler,
+    ChatMemberHandler,
+    ChosenInlineResultHandler,
+    CommandHandler,
+    ConversationHandler,
+    InlineQueryHandler,
+    MessageHandler,
+    PollAnswerHandler,
+    PollHandler,
+    PreCheckoutQueryHandler,
+    PrefixHandler,
+    ShippingQueryHandler,
+    TypeHandler,
+)
+
+from admin import admin_stats
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT_MIN = int(os.getenv('POLL_TIMEOUT_MIN', '5'))
+POLL_TIMEOUT_MAX = int(os.getenv('POLL_TIMEOUT_MAX', '50'))
+POLL_LIMIT_MIN = int(os.getenv('POLL_LIMIT_MIN', '10'))
+POLL_LIMIT_MAX = int(os.getenv('POLL_LIMIT_MAX', '100'))
+# Не запрашиваем новые апдейты, пока в очереди столько необработанных
+POLL_MAX_BACKLOG = int(os.getenv('POLL_MAX_BACKLOG', '1000'))
+POLL_BACKOFF_MAX = 30.0
+
+# Типы апдейтов по классам обработчиков
+HANDLER_UPDATE_TYPES = {
+    CallbackQueryHandler: (Update.CALLBACK_QUERY,),
+    InlineQueryHandler: (Update.INLINE_QUERY,),
+    ChosenInlineResultHandler: (Update.CHOSEN_INLINE_RESULT,),
+    PollHandler: (Update.POLL,),
+    PollAnswerHandler: (Update.POLL_ANSWER,),
+    ChatJoinRequestHandler: (Update.CHAT_JOIN_REQUEST,),
+    PreCheckoutQueryHandler: (Update.PRE_CHECKOUT_QUERY,),
+    ShippingQueryHandler: (Update.SHIPPING_QUERY,),
+}
+
+# filters.UpdateType.* -> типы апдейтов
+FILTER_UPDATE_TYPES = {
+    'MESSAGE': (Update.MESSAGE,),
+    'EDITED_MESSAGE': (Update.EDITED_MESSAGE,),
+    'MESSAGES': (Update.MESSAGE, Update.EDITED_MESSAGE),
+    'CHANNEL_POST': (Update.CHANNEL_POST,),
+    'EDITED_CHANNEL_POST': (Update.EDITED_CHANNEL_POST,),
+    'CHANNEL_POSTS': (Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST),
+    'EDITED': (Update.EDITED_MESSAGE, Update.EDITED_CHANNEL_POST),
+}
+
+
+def _message_update_types(message_filter) -> set:
+    """Типы апдейтов для фильтра MessageHandler/CommandHandler (по умолчанию - новые сообщения)"""
+    names = re.findall(r'UpdateType\.([A-Z_]+)', repr(message_filter))
+    types = {update_type for name in names for update_type in FILTER_UPDATE_TYPES.get(name, ())}
+    return types or {Update.MESSAGE}
+
+
+def _handler_update_types(handler: BaseHandler) -> Optional[set]:
+    """Типы апдейтов обработчика; None - тип неизвестен, нужны все"""
+    if isinstance(handler, ConversationHandler):
+        types = set()
+        nested = handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]
+        for child in nested:
+            child_types = _handler_update_types(child)
+            if child_types is None:
+                return None
+            types |= child_types
+        return types
+    if isinstance(handler, TypeHandler):
+        # Middleware и наблюдатели смотрят на апдейты, но не требуют новых типов
+        return set()
+    if isinstance(handler, (CommandHandler, PrefixHandler, MessageHandler)):
+        return _message_update_types(handler.filters)
+    if isinstance(handler, ChatMemberHandler):
+        if handler.chat_member_types == ChatMemberHandler.MY_CHAT_MEMBER:
+            return {Update.MY_CHAT_MEMBER}
+        if handler.chat_member_types == ChatMemberHandler.CHAT_MEMBER:
+            return {Update.CHAT_MEMBER}
+        return {Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER}
+    for handler_class, update_types in HANDLER_UPDATE_TYPES.items():
+        if isinstance(handler, handler_class):
+            return set(update_types)
+    return None
+
+
+def allowed_updates_for(application: Application) -> List[str]:
+    """allowed_updates для getUpdates/setWebhook по зарегистрированным обработчикам"""
+    types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler_types = _handler_update_types(handler)
+            if handler_types is None:
+                logger.info(f"Неизвестный тип обработчика {type(handler).__name__}, запрашиваем все апдейты")
+                return [str(update_type) for update_type in Update.ALL_TYPES]
+            types |= handler_types
+    return sorted(str(update_type) for update_type in types)
+
+
+def update_lag(update: Update, received: float) -> Optional[float]:
+    """Задержка между отправкой сообщения и его получением ботом"""
+    # У callback_query нет времени нажатия, только время исходного сообщения
+    message = update.message or update.edited_message or update.channel_post
+    if message is None:
+        return None
+    sent = (message.edit_date if update.edited_message else message.date) or message.date
+    return max(0.0, received - sent.timestamp())
+
+
+class UpdatePoller:
+    """Цикл getUpdates с адаптивными limit/timeout и предзагрузкой следующей пачки"""
+
+    def __init__(self, application: Application, allowed_updates: Optional[Sequence[str]] = None,
+                 on_stop: Optional[Callable[[], None]] = None):
+        self.application = application
+        # Вызывается, если цикл getUpdates завершился сам (неверный токен, непредвиденная ошибка)
+        self.on_stop = on_stop
+        self.error: Optional[BaseException] = None
+        self.allowed_updates = list(allowed_updates) if allowed_updates is not None else None
+        self.offset: Optional[int] = None
+        self.limit = POLL_LIMIT_MIN
+        self.timeout = POLL_TIMEOUT_MIN
+        self.batches = 0
+        self.updates = 0
+        self.errors = 0
+        self.last_batch_size = 0
+        self.lag_ewma = 0.0
+        self.max_lag = 0.0
+        self._lag_samples = 0
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Task] = None
+
+    def _adapt(self, count: int):
+        """Полная пачка - на сервере есть еще, берем больше; тишина - ждем дольше и реже"""
+        if count >= self.limit:
+            self.limit = min(POLL_LIMIT_MAX, self.limit * 2)
+        elif count < self.limit // 4:
+            self.limit = max(POLL_LIMIT_MIN, self.limit // 2)
+        if count:
+            # Под нагрузкой короткий таймаут быстрее обнаруживает оборванное соединение
+            self.timeout = POLL_TIMEOUT_MIN
+        else:
+            self.timeout = min(POLL_TIMEOUT_MAX, self.timeout * 2)
+
+    def _record_lag(self, update: Update, received: float):
+        lag = update_lag(update, received)
+        if lag is None:
+            return
+        self.lag_ewma = lag if not self._lag_samples else 0.9 * self.lag_ewma + 0.1 * lag
+        self._lag_samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        admin_stats.record_latency('polling:lag', lag)
+
+    async def _fetch(self):
+        return await self.application.bot.get_updates(
+            offset=self.offset,
+            limit=self.limit,
+            timeout=self.timeout,
+            allowed_updates=self.allowed_updates
+        )
+
+    async def _next_fetch(self) -> asyncio.Task:
+        # Обратное давление: не забираем апдейты быстрее, чем их успевают обработать
+        while self.application.update_queue.qsize() >= POLL_MAX_BACKLOG:
+            await asyncio.sleep(0.05)
+        return asyncio.create_task(self._fetch())
+
+    async def _run(self):
+        failures = 0
+        while True:
+            if self._pending is None:
+                self._pending = await self._next_fetch()
+            try:
+                updates = await self._pending
+            except RetryAfter as e:
+                self._pending = None
+                await asyncio.sleep(float(e.retry_after))
+                continue
+            except InvalidToken:
+                logger.error("Неверный токен бота, polling остановлен")
+                raise
+            except TelegramError as e:
+                # Conflict (второй экземпляр бота) и сетевые ошибки - повтор с задержкой
+                self._pending = None
+                failures += 1
+                self.errors += 1
+                delay = random.uniform(0, min(POLL_BACKOFF_MAX, 0.5 * 2 ** failures))
+                logger.warning(f"Ошибка getUpdates: {e}, повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+
+            self._pending = None
+            failures = 0
+            received = time.time()
+            if updates:
+                self.offset = updates[-1].update_id + 1
+            self._adapt(len(updates))
+            self.batches += 1
+            self.last_batch_size = len(updates)
+
+            # Следующий запрос уходит до постановки текущей пачки в очередь
+            if updates:
+                self._pending = await self._next_fetch()
+            for update in updates:
+                self._record_lag(update, received)
+                self.updates += 1
+                await self.application.update_queue.put(update)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self.application.bot.delete_webhook()
+        logger.info(f"Polling запущен, allowed_updates: {', '.join(self.allowed_updates or ['все'])}")
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+        self.error = task.exception()
+        logger.error(f"Цикл getUpdates завершился, бот больше не получает апдейты: {self.error!r}")
+        if self.on_stop is not None:
+            self.on_stop()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Предзагруженная пачка отменяется: offset не сдвинут, она придет после перезапуска
+        for task in (self._task, self._pending):
+            if task is not None:
+                task.cancel()
+        for task in (self._task, self._pending):
+            if task is not None:
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+        self._pending = None
+        # Подтверждаем обработанный offset, чтобы после перезапуска апдейты не пришли повторно
+        if self.offset is not None:
+            try:
+                await self.application.bot.get_updates(offset=self.offset, limit=1, timeout=0)
+            except TelegramError as e:
+                logger.warning(f"Не удалось подтвердить offset {self.offset}: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "allowed_updates": self.allowed_updates,
+            "limit": self.limit,
+            "timeout": self.timeout,
+            "batches": self.batches,
+            "updates": self.updates,
+            "errors": self.errors,
+            "running": self._task is not None and not self._task.done(),
+            "last_batch_size": self.last_batch_size,
+            "queue_size": self.application.update_queue.qsize(),
+            "lag_ewma_s": round(self.lag_ewma, 2),
+            "max_lag_s": round(self.max_lag, 2),
+        }
+
+
+def run_polling(application: Application, allowed_updates: Optional[Sequence[str]] = None):
+    """Замена Application.run_polling на UpdatePoller: запуск до SIGINT/SIGTERM"""
+    asyncio.run(_serve(application, allowed_updates))
+
+
+async def _serve(application: Application, allowed_updates: Optional[Sequence[str]]):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        poller = UpdatePoller(application, allowed_updates, on_stop=stop_event.set)
+        try:
+            await poller.start()
+            await stop_event.wait()
+        finally:
+            await poller.stop()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+    # Ненулевой код выхода, чтобы процесс перезапустил супервизор
+    if poller.error is not None:
+        raise poller.error
@@ -0,0 +1,118 @@
+"""
+ProThemesRU Telegram Bot - Compact records
+Slotted user records with integer epoch timestamps and lazily created
+containers, and frozen template records shared by catalog snapshots
+"""
+
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+
+def epoch() -> int:
+    """Текущее время в секундах Unix - int вместо datetime"""
+    return int(time.time())
+
+
+class UserRecord:
+    """Пользователь бота.
+
+    Без __dict__: поля хранятся в слотах, время - целыми секундами.
+    customization_data и orders создаются при первом обращении, поэтому
+    пользователь, который только нажал /start, не держит пустые dict и list.
+    """
+
+    __slots__ = (
+        'id', 'first_name', 'last_name', 'username',
+        'created_at', 'last_activity', 'selected_template',
+        '_customization_data', '_orders',
+    )
+
+    def __init__(self, user_id: int, first_name: Optional[str] = None,
+                 last_name: Optional[str] = None, username: Optional[str] = None,
+                 created_at: Optional[int] = None):
+        self.id = user_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.created_at = created_at if created_at is not None else epoch()
+        self.last_activity = self.created_at
+        self.selected_template: Optional[int] = None
+        self._customization_data: Optional[Dict[str, Any]] = None
+        self._orders: Optional[List[Any]] = None
+
+    @property
+    def customization_data(self) -> Dict[str, Any]:
+        if self._customization_data is None:
+            self._customization_data = {}
+        return self._customization_data
+
+    @customization_data.setter
+    def customization_data(self, value: Dict[str, Any]):
+        self._customization_data = value
+
+    @property
+    def orders(self) -> List[Any]:
+        if self._orders is None:
+            self._orders = []
+        return self._orders
+
+    @orders.setter
+    def orders(self, value: List[Any]):
+        self._orders = value
+
+    def update(self, data: Mapping[str, Any]):
+        """Обновление полей из словаря; неизвестное поле - AttributeError"""
+        for field, value in data.items():
+            setattr(self, field, value)
+
+    def touch(self, now: Optional[int] = None):
+        self.last_activity = now if now is not None else epoch()
+
+    def __repr__(self) -> str:
+        return f"UserRecord(id={self.id!r}, username={self.username!r})"
+
+
+@dataclass(frozen=True, slots=True)
+class TemplateRecord:
+    """Шаблон из каталога: неизменяемый, без __dict__.
+
+    Поддерживает доступ template['name'], которым пользуются обработчики
+    и подписи, так что запись подменяет прежний словарь без правок вызывающего кода.
+    """
+
+    id: int
+    name: str
+    category: str
+    tier: str
+    price: int
+    description: str
+    features: Tuple[str, ...]
+    preview_image: str
+
+    @classmethod
+    def from_dict(cls, template: Mapping[str, Any]) -> 'TemplateRecord':
+        # Категории и тарифы повторяются во всех шаблонах - одна строка на значение
+        return cls(
+            id=template['id'],
+            name=template['name'],
+            category=sys.intern(template['category']),
+            tier=sys.intern(template['tier']),
+            price=template['price'],
+            description=template['description'],
+            features=tuple(template.get('features', ())),
+            preview_image=template['preview_image'],
+        )
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in self.__dataclass_fields__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
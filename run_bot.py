@@ -7,9 +7,22 @@ Runs the bot in polling mode for Render worker dyno
 import os
 import logging
 import asyncio
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+import signal
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from telegram import Update
-import json
+from telegram.constants import ParseMode
+
+from throttling import throttle_manager, throttle_middleware
+from i18n import catalog, get_locale
+from app import register_status_provider, start_web_server
+from sharding import BOT_WORKERS, ShardedDispatcher
+from analytics import campaign_from_args, event_tracker, track_update
+from admin import register_admin_handlers
+from template_catalog import TemplateManager, format_price
+from bot_api import BOT_API_FILE_URL, BOT_API_URL, ResilientRequest, get_stats as get_bot_api_stats
+from polling import UpdatePoller, allowed_updates_for
+from scheduler import scheduler
+from tracing import TracingApplication, TRACE_EXPORT_INTERVAL, instrument, tracer
 
 # Configure logging
 logging.basicConfig(
@@ -22,290 +35,136 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_CHAT_ID = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
 
-def load_templates():
-    """Load templates from JSON files"""
-    template_paths = [
-        'templates/blocks/premium_templates.json',
-        '../templates/blocks/premium_templates.json',
-        'design_templates.json',
-        '../design_templates.json'
-    ]
-    
-    for path in template_paths:
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Если файл содержит вложенную структуру
-                if 'premium_templates' in data:
-                    return data
-                elif 'templates' in data:
-                    return {"premium_templates": data['templates']}
-                else:
-                    return {"premium_templates": data}
-        except FileNotFoundError:
-            continue
-    
-    logger.warning("Templates file not found, using default")
-    return {
-        "premium_templates": [
-            {
-                "id": 1,
-                "name": "Современный SaaS Лендинг",
-                "category": "saas",
-                "price": 15000,
-                "description": "Премиум лендинг для SaaS продуктов"
-            },
-            {
-                "id": 2,
-                "name": "Креативное Агентство",
-                "category": "agency",
-                "price": 12000,
-                "description": "Стильный сайт для креативных агентств"
-            },
-            {
-                "id": 3,
-                "name": "Премиум E-commerce",
-                "category": "ecommerce",
-                "price": 25000,
-                "description": "Полнофункциональный интернет-магазин"
-            }
-        ]
-    }
+# Web server configuration (Render sets PORT for web services)
+WEB_SERVER_PORT = os.getenv('WEB_SERVER_PORT', os.getenv('PORT'))
+ENABLE_WEBHOOK = os.getenv('ENABLE_WEBHOOK', 'false').lower() == 'true'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+# Catalog shared by the command handlers, hot-reloaded from templates.json
+template_manager = TemplateManager()
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user = update.effective_user
-    welcome_text = f"""
-🚀 Добро пожаловать в ProThemesRU, {user.first_name}!
-
-🎨 Создайте профессиональный сайт за несколько минут!
-
-Выберите действие:
-/start - Главное меню
-/templates - 📚 Шаблоны сайтов
-/blocks - 🧱 UI компоненты  
-/styles - 🎨 Стили и эффекты
-/constructor - 🛠️ Конструктор сайтов
-/order - 📦 Заказать сайт
-/pricing - 💰 Цены и тарифы
-/help - ❓ Помощь
-
-💡 Начните с /templates чтобы посмотреть готовые шаблоны!
-    """
+    # Deep link t.me/ProThemesRUBot?start=<campaign>; recorded by track_update
+    campaign = campaign_from_args(context.args)
+    if campaign:
+        context.campaign = campaign
+    welcome_text = catalog.get(get_locale(update), 'cmd.start', first_name=user.first_name)
     
-    await update.message.reply_text(welcome_text)
+    await update.message.reply_text(welcome_text, parse_mode=ParseMode.HTML)
 
 async def templates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /templates command"""
-    templates = load_templates()
+    templates = template_manager.snapshot
+    locale = get_locale(update)
     
-    response = "📚 **Доступные шаблоны:**\n\n"
+    response = catalog.get(locale, 'cmd.templates.header')
     
-    for template in templates.get('premium_templates', [])[:5]:  # Show first 5
-        response += f"🎨 **{template['name']}**\n"
-        response += f"📂 Категория: {template['category']}\n"
-        response += f"💰 Цена: {template['price']} ₽\n"
-        response += f"📝 {template['description']}\n\n"
+    for template in templates.page(0, 5):  # Show first 5
+        response += catalog.get(
+            locale, 'cmd.templates.item',
+            name=template['name'],
+            category=template['category'],
+            price=format_price(template['price']),
+            description=template['description']
+        )
     
-    response += "💡 Используйте /order для заказа шаблона"
+    response += catalog.get(locale, 'cmd.templates.footer')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def blocks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /blocks command"""
-    response = """🧱 **UI Компоненты и блоки:**
-
-🎯 **Категории блоков:**
-• 💼 Бизнес-блоки
-• 🎨 Портфолио
-• 🛒 E-commerce
-• 🏢 Корпоративные
-• 📝 Блог
-• 🍽️ Рестораны
-• 🏠 Недвижимость
-• 🏥 Медицина
-
-💡 **Доступно более 50 компонентов!**
-
-🔧 Используйте /constructor для создания сайта
-📦 Используйте /order для заказа
-    """
+    response = catalog.get(get_locale(update), 'cmd.blocks')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def styles_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /styles command"""
-    response = """🎨 **Современные стили и эффекты:**
-
-🌈 **Градиенты:**
-• Neon - Неоновые эффекты
-• Sunset - Закатные тона
-• Ocean - Морские оттенки
-• Forest - Лесные цвета
-• Fire - Огненные градиенты
-• Aurora - Северное сияние
-
-✨ **Эффекты:**
-• Glass - Стеклянные элементы
-• Hover - Анимации при наведении
-• Scroll - Анимации при скролле
-• Loading - Загрузочные анимации
-
-🎯 **Кнопки:**
-• Modern - Современные
-• Neon - Неоновые
-• Glass - Стеклянные
-
-💡 **30+ готовых стилей!**
-    """
+    response = catalog.get(get_locale(update), 'cmd.styles')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def constructor_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /constructor command"""
-    response = """🛠️ **Конструктор сайтов ProThemesRU**
-
-🎯 **Возможности:**
-• 🎨 Визуальный редактор
-• 🧱 Drag & Drop блоки
-• 📱 Адаптивный дизайн
-• ⚡ Быстрая сборка
-• 📤 Экспорт в HTML/CSS
-
-🚀 **Начните создание:**
-1. Выберите шаблон (/templates)
-2. Настройте блоки (/blocks)
-3. Примените стили (/styles)
-4. Закажите готовый сайт (/order)
-
-💡 **Создайте сайт за 10 минут!**
-    """
+    response = catalog.get(get_locale(update), 'cmd.constructor')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def order_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /order command"""
-    response = """📦 **Заказать сайт**
-
-🎯 **Тарифы:**
-• 🚀 **Старт** - 5,000 ₽
-  - Лендинг страница
-  - Адаптивный дизайн
-  - 3 дня разработки
-
-• 💼 **Бизнес** - 15,000 ₽
-  - Многостраничный сайт
-  - CMS система
-  - SEO оптимизация
-  - 7 дней разработки
-
-• ⭐ **Премиум** - 25,000 ₽
-  - E-commerce функционал
-  - Интеграции
-  - Аналитика
-  - 14 дней разработки
-
-📞 **Свяжитесь с нами:**
-• Telegram: @ProThemesSupport
-• Email: support@prothemes.ru
-• Сайт: https://prothemes.ru
-
-💡 Укажите в сообщении желаемый тариф!
-    """
+    response = catalog.get(get_locale(update), 'cmd.order')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def pricing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /pricing command"""
-    response = """💰 **Цены и тарифы ProThemesRU**
-
-🎯 **Создание сайтов:**
-• 🚀 Лендинг: от 5,000 ₽
-• 💼 Корпоративный: от 15,000 ₽
-• 🛒 Интернет-магазин: от 25,000 ₽
-• 🎨 Портфолио: от 8,000 ₽
-
-📦 **Готовые шаблоны:**
-• 📚 Базовые: 2,000 ₽
-• ⭐ Премиум: 5,000 ₽
-• 🏆 VIP: 10,000 ₽
-
-🔧 **Дополнительные услуги:**
-• 📱 Мобильная версия: +2,000 ₽
-• 🔍 SEO оптимизация: +3,000 ₽
-• 📊 Аналитика: +1,500 ₽
-• 🚀 Ускорение: +50% к цене
-
-💡 **Акции и скидки:**
-• 🎉 Первый заказ: -20%
-• 👥 Оптом: -15%
-• ⏰ Срочно: +30%
-
-📞 Закажите через /order
-    """
+    response = catalog.get(get_locale(update), 'cmd.pricing')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
-    response = """❓ **Помощь по ProThemesRU**
-
-🎯 **Основные команды:**
-/start - Главное меню
-/templates - Просмотр шаблонов
-/blocks - UI компоненты
-/styles - Стили и эффекты
-/constructor - Создание сайта
-/order - Заказать сайт
-/pricing - Цены и тарифы
-/help - Эта справка
-
-💡 **Как создать сайт:**
-1. Выберите шаблон (/templates)
-2. Настройте блоки (/blocks)
-3. Примените стили (/styles)
-4. Закажите готовый сайт (/order)
-
-📞 **Поддержка:**
-• Telegram: @ProThemesSupport
-• Email: support@prothemes.ru
-• Сайт: https://prothemes.ru
-
-🚀 **Готовы создать сайт? Начните с /start!**
-    """
+    response = catalog.get(get_locale(update), 'cmd.help')
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle regular messages"""
     message_type = update.message.chat.type
     text = update.message.text
+    locale = get_locale(update)
     
     logger.info(f'User ({update.message.chat.id}) in {message_type}: "{text}"')
     
     if message_type == 'group':
         if '@ProThemesRUBot' in text:
             new_text = text.replace('@ProThemesRUBot', '').strip()
-            response = f'Привет! Вы написали: "{new_text}"'
+            response = catalog.get(locale, 'cmd.echo_group', text=new_text)
         else:
             return
     else:
-        response = f'Вы написали: "{text}"\n\n💡 Используйте /start для главного меню'
+        response = catalog.get(locale, 'cmd.echo_private', text=text)
     
-    await update.message.reply_text(response)
+    await update.message.reply_text(response, parse_mode=ParseMode.HTML)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
     logger.error(f'Exception while handling an update: {context.error}')
 
-async def main():
-    """Main function"""
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN not configured!")
-        return
+async def post_init(application: Application) -> None:
+    """Start background tasks"""
+    await event_tracker.start()
+    scheduler.add('analytics_flush', event_tracker.flush, event_tracker.flush_interval)
+    scheduler.add('catalog_refresh', template_manager.refresh, template_manager.check_interval)
+    if tracer.enabled and tracer.path:
+        scheduler.add('trace_export', tracer.export, TRACE_EXPORT_INTERVAL)
+    await scheduler.start(application)
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background tasks"""
+    await scheduler.stop()
+    await event_tracker.stop()
+    await tracer.export()
+
+def build_application() -> Application:
+    """Create the application with all handlers (also used by shard workers)"""
+    application = (
+        Application.builder()
+        .application_class(TracingApplication)
+        .token(BOT_TOKEN)
+        .request(ResilientRequest())
+        .base_url(BOT_API_URL)
+        .base_file_url(BOT_API_FILE_URL)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Anti-spam middleware runs before every other handler group
+    application.add_handler(TypeHandler(Update, throttle_middleware), group=-1)
     
     # Add handlers
     application.add_handler(CommandHandler('start', start_command))
@@ -317,17 +176,99 @@ async def main():
     application.add_handler(CommandHandler('pricing', pricing_command))
     application.add_handler(CommandHandler('help', help_command))
     
+    # Admin commands and handler timing (before the catch-all text handler)
+    register_admin_handlers(application, reload_templates=template_manager.reload)
+    
     # Add message handler
     application.add_handler(MessageHandler(filters.TEXT, handle_message))
     
+    # Analytics observes only updates that passed the anti-spam filter
+    application.add_handler(TypeHandler(Update, track_update), group=1)
+    
     # Add error handler
     application.add_error_handler(error_handler)
     
-    # Start polling
-    logger.info("Starting bot in polling mode...")
-    await application.initialize()
-    await application.start()
-    await application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Handler spans for sampled traces (no-op unless TRACE_SAMPLE_RATE > 0)
+    instrument(application)
+    
+    return application
+
+async def main():
+    """Main function"""
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN not configured!")
+        return
+    
+    if ENABLE_WEBHOOK and not (WEB_SERVER_PORT and WEBHOOK_URL):
+        logger.error("Webhook mode requires WEBHOOK_URL and WEB_SERVER_PORT (or PORT)")
+        return
+    
+    # Create application: either the bot itself or an ingress that feeds shard workers
+    if BOT_WORKERS > 1:
+        dispatcher = ShardedDispatcher(build_application, BOT_WORKERS)
+        application = dispatcher.build_ingress(BOT_TOKEN)
+        register_status_provider('sharding', dispatcher.get_stats)
+        logger.info(f"Sharded mode: {BOT_WORKERS} worker processes")
+    else:
+        application = build_application()
+        register_status_provider('throttling', throttle_manager.get_stats)
+        register_status_provider('analytics', event_tracker.get_stats)
+        register_status_provider('catalog', template_manager.get_stats)
+        register_status_provider('bot_api', get_bot_api_stats)
+        register_status_provider('scheduler', scheduler.get_stats)
+        register_status_provider('tracing', tracer.get_stats)
+    
+    # Only the update types the handlers consume (the ingress forwards to the same handlers)
+    allowed_updates = allowed_updates_for(application if BOT_WORKERS <= 1 else build_application())
+    poller = None
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        
+        # Web endpoints share the event loop with the bot
+        web_runner = None
+        if WEB_SERVER_PORT:
+            # The ingress process does not run the bot's catalog refresh job, so it gets its own manager
+            web_runner = await start_web_server(
+                application, port=int(WEB_SERVER_PORT),
+                template_manager=template_manager if BOT_WORKERS <= 1 else None
+            )
+        
+        if ENABLE_WEBHOOK:
+            logger.info("Starting bot in webhook mode...")
+            await application.bot.set_webhook(
+                WEBHOOK_URL,
+                allowed_updates=allowed_updates,
+                secret_token=WEBHOOK_SECRET
+            )
+        else:
+            logger.info("Starting bot in polling mode...")
+            poller = UpdatePoller(application, allowed_updates, on_stop=stop_event.set)
+            register_status_provider('polling', poller.get_stats)
+            await poller.start()
+        
+        try:
+            await stop_event.wait()
+        finally:
+            logger.info("Stopping bot...")
+            if web_runner is not None:
+                await web_runner.cleanup()
+            if poller is not None:
+                await poller.stop()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+    
+    # Polling died on its own: exit non-zero so the worker gets restarted
+    if poller is not None and poller.error is not None:
+        raise poller.error
 
 if __name__ == '__main__':
     asyncio.run(main()) 
\ No newline at end of file
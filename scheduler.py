@@ -0,0 +1,183 @@
+"""
+ProThemesRU Telegram Bot - Background scheduler
+Named periodic jobs with jittered intervals, overlap protection and
+per-job timings; housekeeping yields to the update queue when it is busy
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram.ext import Application
+
+from admin import admin_stats
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Случайный разброс интервала (доля), чтобы задачи разных процессов не совпадали
+SCHEDULER_JITTER = float(os.getenv('SCHEDULER_JITTER', '0.1'))
+# При такой очереди необработанных апдейтов задачи откладываются
+SCHEDULER_BUSY_QUEUE = int(os.getenv('SCHEDULER_BUSY_QUEUE', '50'))
+SCHEDULER_BUSY_DELAY = 1.0
+# Сколько ждать завершения выполняющихся задач при остановке
+SCHEDULER_STOP_TIMEOUT = float(os.getenv('SCHEDULER_STOP_TIMEOUT', '5'))
+
+
+class Job:
+    """Периодическая задача и ее статистика"""
+
+    def __init__(self, name: str, callback: Callable[[], Awaitable], interval: float,
+                 first_delay: Optional[float] = None, jitter: float = SCHEDULER_JITTER):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.first_delay = first_delay
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.deferred = 0
+        self.last_run: Optional[int] = None
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error: Optional[str] = None
+        self.next_run: Optional[float] = None
+        self.loop_task: Optional[asyncio.Task] = None
+        self.run_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.run_task is not None and not self.run_task.done()
+
+    def delay(self, first: bool = False) -> float:
+        base = self.first_delay if first and self.first_delay is not None else self.interval
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def get_stats(self) -> Dict:
+        return {
+            "interval_s": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "deferred": self.deferred,
+            "running": self.running,
+            "last_run": self.last_run,
+            "last_ms": round(self.last_duration * 1000, 2),
+            "avg_ms": round(self.total_duration / self.runs * 1000, 2) if self.runs else 0.0,
+            "max_ms": round(self.max_duration * 1000, 2),
+            "next_run_in_s": round(max(0.0, self.next_run - time.monotonic()), 1) if self.next_run else None,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    """Фоновые задачи вне обработчиков апдейтов.
+
+    Задача не запускается, пока не закончился ее предыдущий запуск (пропуск
+    учитывается в skipped), и откладывается, пока очередь апдейтов переполнена,
+    но не дольше одного интервала.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.application: Optional[Application] = None
+        self._started = False
+
+    def add(self, name: str, callback: Callable[[], Awaitable], interval: float,
+            first_delay: Optional[float] = None, jitter: float = SCHEDULER_JITTER) -> Optional[Job]:
+        """Регистрация задачи; интервал 0 - задача отключена"""
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        if interval <= 0:
+            logger.info(f"Фоновая задача {name} отключена")
+            return None
+        job = self.jobs[name] = Job(name, callback, interval, first_delay, jitter)
+        if self._started:
+            job.loop_task = asyncio.create_task(self._loop(job))
+        return job
+
+    def _busy(self) -> bool:
+        return self.application is not None and self.application.update_queue.qsize() >= SCHEDULER_BUSY_QUEUE
+
+    async def _wait_idle(self, job: Job):
+        waited = 0.0
+        if self._busy():
+            job.deferred += 1
+        while self._busy() and waited < job.interval:
+            await asyncio.sleep(SCHEDULER_BUSY_DELAY)
+            waited += SCHEDULER_BUSY_DELAY
+
+    async def _run(self, job: Job):
+        started = time.perf_counter()
+        try:
+            with tracer.trace(f"job {job.name}"):
+                await job.callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error(f"Ошибка фоновой задачи {job.name}: {e}")
+        else:
+            job.last_error = None
+        finally:
+            duration = time.perf_counter() - started
+            job.runs += 1
+            job.last_run = int(time.time())
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+            admin_stats.record_latency(f"job:{job.name}", duration)
+
+    async def _loop(self, job: Job):
+        delay = job.delay(first=True)
+        while True:
+            job.next_run = time.monotonic() + delay
+            await asyncio.sleep(delay)
+            if job.running:
+                job.skipped += 1
+                logger.warning(f"Фоновая задача {job.name} еще выполняется, запуск пропущен")
+            else:
+                await self._wait_idle(job)
+                job.run_task = asyncio.create_task(self._run(job))
+            delay = job.delay()
+
+    async def start(self, application: Optional[Application] = None):
+        if self._started:
+            return
+        self.application = application
+        self._started = True
+        for job in self.jobs.values():
+            job.loop_task = asyncio.create_task(self._loop(job))
+        if self.jobs:
+            logger.info(f"Фоновые задачи: {', '.join(self.jobs)}")
+
+    async def stop(self):
+        """Остановка расписания; выполняющимся задачам дается SCHEDULER_STOP_TIMEOUT секунд"""
+        if not self._started:
+            return
+        self._started = False
+        for job in self.jobs.values():
+            if job.loop_task is not None:
+                job.loop_task.cancel()
+        running = [job.run_task for job in self.jobs.values() if job.running]
+        if running:
+            done, pending = await asyncio.wait(running, timeout=SCHEDULER_STOP_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await asyncio.gather(*(job.loop_task for job in self.jobs.values() if job.loop_task),
+                             return_exceptions=True)
+        self.jobs.clear()
+        self.application = None
+
+    def get_stats(self) -> Dict:
+        return {name: job.get_stats() for name, job in sorted(self.jobs.items())}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,231 @@
+"""
+ProThemesRU Telegram Bot - Sharded update processing
+One ingress process fans updates out to N worker processes by chat_id
+"""
+
+import os
+import json
+import time
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Callable, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from bot_api import BOT_API_FILE_URL, BOT_API_URL, ResilientRequest
+
+logger = logging.getLogger(__name__)
+
+# Количество процессов-обработчиков (1 - без шардирования)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+HEARTBEAT_INTERVAL = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '5'))
+HEALTH_CHECK_INTERVAL = float(os.getenv('WORKER_HEALTH_CHECK_INTERVAL', '10'))
+
+# spawn: воркеры не наследуют event loop и сетевые соединения родителя
+_mp = multiprocessing.get_context('spawn')
+
+# Сигнал остановки воркера
+STOP = None
+
+
+def shard_key(update: Update) -> int:
+    """Ключ шардирования: чат, затем пользователь, затем id апдейта"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+def shard_for(key: int, num_shards: int) -> int:
+    """Стабильный номер шарда: один чат всегда попадает в один процесс"""
+    return key % num_shards
+
+
+def worker_main(shard_id: int, factory: Callable[[], Application], updates,
+                heartbeat, received, processed):
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C получает вся группа процессов, останавливаем воркеры через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(shard_id, factory, updates, heartbeat, received, processed))
+
+
+async def _run_worker(shard_id: int, factory: Callable[[], Application], updates,
+                      heartbeat, received, processed):
+    application = factory()
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Воркер шарда {shard_id} запущен (PID {os.getpid()})")
+
+        while True:
+            # Пульс обновляется только между апдейтами: у зависшего обработчика он устаревает
+            heartbeat.value = time.time()
+            try:
+                data = await loop.run_in_executor(None, updates.get, True, HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                continue
+            if data is STOP:
+                break
+
+            with received.get_lock():
+                received.value += 1
+            # Апдейты обрабатываются по одному - порядок внутри чата сохраняется
+            await application.process_update(Update.de_json(json.loads(data), application.bot))
+            with processed.get_lock():
+                processed.value += 1
+
+        logger.info(f"Воркер шарда {shard_id} останавливается")
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+class ShardWorker:
+    """Процесс-обработчик одного шарда и его показатели"""
+
+    def __init__(self, shard_id: int):
+        self.shard_id = shard_id
+        self.updates = _mp.Queue()
+        self.heartbeat = _mp.Value('d', 0.0)
+        self.received = _mp.Value('q', 0)
+        self.processed = _mp.Value('q', 0)
+        self.dispatched = 0
+        self.restarts = 0
+        self.last_restart: Optional[float] = None
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+
+    def start(self, factory: Callable[[], Application]):
+        self.heartbeat.value = time.time()
+        self.process = _mp.Process(
+            target=worker_main,
+            args=(self.shard_id, factory, self.updates, self.heartbeat, self.received, self.processed),
+            name=f'bot-shard-{self.shard_id}',
+            daemon=True,
+        )
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def get_stats(self) -> dict:
+        try:
+            queued = self.updates.qsize()
+        except NotImplementedError:  # macOS
+            queued = None
+        return {
+            "shard": self.shard_id,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.is_alive(),
+            "heartbeat_age": round(time.time() - self.heartbeat.value, 1),
+            "dispatched": self.dispatched,
+            "received": self.received.value,
+            "processed": self.processed.value,
+            "queued": queued,
+            "restarts": self.restarts,
+            "last_restart": self.last_restart,
+        }
+
+
+class ShardedDispatcher:
+    """Входной процесс: принимает апдейты и раскладывает их по воркерам"""
+
+    def __init__(self, factory: Callable[[], Application], num_workers: int = BOT_WORKERS):
+        self.factory = factory
+        self.workers: List[ShardWorker] = [ShardWorker(i) for i in range(num_workers)]
+        self._supervisor: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def build_ingress(self, token: str) -> Application:
+        """Приложение без бизнес-логики: только получение и маршрутизация апдейтов"""
+        application = (
+            Application.builder()
+            .token(token)
+            .request(ResilientRequest())
+            .base_url(BOT_API_URL)
+            .base_file_url(BOT_API_FILE_URL)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
+        application.add_handler(TypeHandler(Update, self.dispatch))
+        return application
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Отправка апдейта в очередь шарда"""
+        worker = self.workers[shard_for(shard_key(update), len(self.workers))]
+        # Очереди неограниченные, put не блокирует event loop
+        worker.updates.put(update.to_json())
+        worker.dispatched += 1
+
+    async def _post_init(self, application: Application) -> None:
+        self.start()
+
+    async def _post_shutdown(self, application: Application) -> None:
+        await self.stop()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start(self.factory)
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info(f"Запущено {len(self.workers)} воркеров")
+
+    async def _supervise(self):
+        """Перезапуск упавших воркеров; очередь шарда переживает перезапуск.
+
+        Шарды между воркерами не перераспределяются; зависший воркер (процесс жив,
+        пульс устарел) только отмечается в логе и в /status как нездоровый.
+        """
+        while not self._stopping:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for worker in self.workers:
+                if self._stopping:
+                    break
+                if worker.is_alive():
+                    stale = time.time() - worker.heartbeat.value
+                    if stale >= HEARTBEAT_INTERVAL * 3:
+                        logger.warning(f"Воркер шарда {worker.shard_id} не обрабатывает апдейты "
+                                       f"{stale:.0f} с")
+                    continue
+                logger.error(f"Воркер шарда {worker.shard_id} завершился "
+                             f"(код {worker.process.exitcode}), перезапускаем")
+                worker.restarts += 1
+                worker.last_restart = time.time()
+                worker.start(self.factory)
+
+    async def stop(self, timeout: float = 10.0):
+        if self._stopping:
+            return
+        self._stopping = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+
+        # Воркеры дообрабатывают свои очереди и выходят по сигналу STOP
+        for worker in self.workers:
+            worker.updates.put(STOP)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, timeout)
+            if worker.process.is_alive():
+                logger.warning(f"Воркер шарда {worker.shard_id} не остановился, завершаем")
+                worker.process.terminate()
+
+    def get_stats(self) -> dict:
+        workers = [worker.get_stats() for worker in self.workers]
+        return {
+            "workers": len(workers),
+            "healthy": sum(
+                1 for w in workers
+                if w["alive"] and w["heartbeat_age"] < HEARTBEAT_INTERVAL * 3
+            ),
+            "shards": workers,
+        }
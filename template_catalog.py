@@ -0,0 +1,468 @@
+"""
+ProThemesRU Telegram Bot - Template catalog
+templates.json is the authoring format: it is validated and normalized
+against a schema, then compiled into a versioned msgpack snapshot that every
+process loads without re-parsing JSON. Catalog snapshots are immutable and
+hot-reloaded off the event loop
+"""
+
+import os
+import re
+import sys
+import json
+import struct
+import asyncio
+import hashlib
+import logging
+import argparse
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from telegram import Message
+
+from records import TemplateRecord
+from tracing import span
+
+try:
+    import msgpack
+except ImportError:  # без msgpack каталог каждый раз собирается из JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_PATH = os.getenv('TEMPLATES_PATH', 'templates.json')
+# Скомпилированный снимок; по умолчанию рядом с исходником (templates.json -> templates.catalog)
+TEMPLATES_SNAPSHOT = os.getenv('TEMPLATES_SNAPSHOT')
+TEMPLATES_CHECK_INTERVAL = float(os.getenv('TEMPLATES_CHECK_INTERVAL', '30'))
+
+# Пути к файлу шаблонов в порядке приоритета
+TEMPLATE_PATHS = list(dict.fromkeys([
+    TEMPLATES_PATH,
+    'templates/blocks/premium_templates.json',
+    '../templates/blocks/premium_templates.json',
+    'design_templates.json',
+    '../design_templates.json'
+]))
+
+# Версия схемы и формата снимка: при изменении старые снимки пересобираются
+SCHEMA_VERSION = 1
+SNAPSHOT_MAGIC = b'PTRC'
+SNAPSHOT_HEADER = struct.Struct('>4sH32s')
+
+# Поля шаблона после нормализации, в порядке столбцов снимка
+FIELDS = ('id', 'name', 'category', 'tier', 'price', 'description', 'features', 'preview_image')
+REQUIRED_FIELDS = ('id', 'name', 'category', 'price', 'description', 'preview_image')
+
+# Разделы templates.json -> тариф шаблона
+SECTIONS = {'premium_templates': 'premium', 'basic_templates': 'basic', 'templates': 'premium'}
+
+# Названия категорий из старых файлов -> ключ категории
+CATEGORY_ALIASES = {
+    'бизнес': 'business',
+    'портфолио': 'portfolio',
+    'e-commerce': 'ecommerce',
+    'интернет-магазин': 'ecommerce',
+    'корпоративный': 'corporate',
+    'агентство': 'agency',
+    'ресторан': 'restaurant',
+    'недвижимость': 'realestate',
+    'лендинг': 'landing',
+}
+CATEGORY_RE = re.compile(r'^[a-z0-9][a-z0-9-]*$')
+PRICE_RE = re.compile(r'^(\d+)(?:[.,]0+)?(?:₽|р\.?|руб\.?|rub)?$')
+
+DEMO_TEMPLATES = [
+    {
+        "id": 1,
+        "name": "Бизнес-лендинг",
+        "category": "Бизнес",
+        "features": ["Адаптивный дизайн", "SEO-оптимизация", "Формы обратной связи"],
+        "preview_image": "https://via.placeholder.com/300x200/4A90E2/FFFFFF?text=Бизнес-лендинг",
+        "price": "5000₽",
+        "description": "Современный лендинг для бизнеса"
+    },
+    {
+        "id": 2,
+        "name": "Портфолио",
+        "category": "Портфолио",
+        "features": ["Галерея работ", "Анимации", "Контактная форма"],
+        "preview_image": "https://via.placeholder.com/300x200/50C878/FFFFFF?text=Портфолио",
+        "price": "4000₽",
+        "description": "Стильное портфолио для творческих людей"
+    },
+    {
+        "id": 3,
+        "name": "Интернет-магазин",
+        "category": "E-commerce",
+        "features": ["Каталог товаров", "Корзина", "Онлайн-оплата"],
+        "preview_image": "https://via.placeholder.com/300x200/FF6B6B/FFFFFF?text=Магазин",
+        "price": "8000₽",
+        "description": "Полнофункциональный интернет-магазин"
+    }
+]
+
+
+class TemplateCatalogError(ValueError):
+    """Файл шаблонов не прошел проверку"""
+
+
+def normalize_price(value: Any) -> int:
+    """Цена в рублях: 15000, "5000₽", "5 000 руб." -> int"""
+    if isinstance(value, bool):
+        raise TemplateCatalogError(f"некорректная цена {value!r}")
+    if isinstance(value, int):
+        price = value
+    elif isinstance(value, float) and value.is_integer():
+        price = int(value)
+    elif isinstance(value, str):
+        match = PRICE_RE.match(re.sub(r'\s+', '', value.lower()))
+        if match is None:
+            raise TemplateCatalogError(f"некорректная цена {value!r}")
+        price = int(match.group(1))
+    else:
+        raise TemplateCatalogError(f"некорректная цена {value!r}")
+    if price < 0:
+        raise TemplateCatalogError(f"отрицательная цена {value!r}")
+    return price
+
+
+def normalize_category(value: Any) -> str:
+    """Ключ категории: "E-commerce" -> "ecommerce", "Real Estate" -> "real-estate" """
+    if not isinstance(value, str):
+        raise TemplateCatalogError(f"некорректная категория {value!r}")
+    category = value.strip().lower()
+    category = CATEGORY_ALIASES.get(category, re.sub(r'[\s_]+', '-', category))
+    if not CATEGORY_RE.match(category):
+        raise TemplateCatalogError(f"некорректная категория {value!r}")
+    return category
+
+
+def format_price(price: int) -> str:
+    """Цена для показа пользователю: 15000 -> "15 000 ₽" """
+    return f"{price:,} ₽".replace(',', ' ')
+
+
+def _text(template: Dict, field: str) -> str:
+    value = template[field]
+    if not isinstance(value, str) or not value.strip():
+        raise TemplateCatalogError(f"{field} должен быть непустой строкой")
+    return value.strip()
+
+
+def normalize_template(template: Any, index: int, tier: str) -> Dict:
+    """Проверка одного шаблона и приведение к FIELDS"""
+    try:
+        if not isinstance(template, dict):
+            raise TemplateCatalogError("ожидается объект")
+        missing = [field for field in REQUIRED_FIELDS if field not in template]
+        if missing:
+            raise TemplateCatalogError(f"нет полей {', '.join(missing)}")
+        if isinstance(template['id'], bool) or not isinstance(template['id'], int):
+            raise TemplateCatalogError("id должен быть числом")
+        features = template.get('features', [])
+        if not isinstance(features, list) or not all(isinstance(f, str) for f in features):
+            raise TemplateCatalogError("features должен быть списком строк")
+        tier = template.get('tier', tier)
+        if tier not in ('premium', 'basic'):
+            raise TemplateCatalogError(f"неизвестный тариф {tier!r}")
+        return {
+            "id": template['id'],
+            "name": _text(template, 'name'),
+            "category": normalize_category(template['category']),
+            "tier": tier,
+            "price": normalize_price(template['price']),
+            "description": _text(template, 'description'),
+            "features": features,
+            "preview_image": _text(template, 'preview_image'),
+        }
+    except TemplateCatalogError as e:
+        raise TemplateCatalogError(f"шаблон #{index}: {e}") from None
+
+
+def validate_templates(data: Any) -> List[Dict]:
+    """Разбор содержимого файла шаблонов; при ошибке - TemplateCatalogError"""
+    if isinstance(data, list):
+        sections = [(data, 'premium')]
+    elif isinstance(data, dict) and any(key in data for key in SECTIONS):
+        sections = [(data[key], tier) for key, tier in SECTIONS.items() if key in data]
+    else:
+        raise TemplateCatalogError("ожидается список шаблонов или разделы premium_templates/basic_templates")
+
+    templates = []
+    seen = set()
+    for items, tier in sections:
+        if not isinstance(items, list):
+            raise TemplateCatalogError("раздел шаблонов должен быть списком")
+        for template in items:
+            index = len(templates)
+            normalized = normalize_template(template, index, tier)
+            if normalized['id'] in seen:
+                raise TemplateCatalogError(f"шаблон #{index}: повторяется id {normalized['id']}")
+            seen.add(normalized['id'])
+            templates.append(normalized)
+    return templates
+
+
+def snapshot_path(source: str) -> str:
+    """Путь к скомпилированному снимку для файла шаблонов"""
+    if TEMPLATES_SNAPSHOT and os.path.abspath(source) == os.path.abspath(TEMPLATES_PATH):
+        return TEMPLATES_SNAPSHOT
+    return os.path.splitext(source)[0] + '.catalog'
+
+
+def compile_catalog(templates: List[Dict], digest: bytes) -> bytes:
+    """Снимок: заголовок (метка, версия схемы, sha256 исходника) + строки в msgpack"""
+    payload = msgpack.packb({
+        "fields": FIELDS,
+        "rows": [[template[field] for field in FIELDS] for template in templates],
+    }, use_bin_type=True)
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SCHEMA_VERSION, digest) + payload
+
+
+def read_snapshot(path: str, digest: bytes) -> Optional[List[Dict]]:
+    """Шаблоны из снимка, если он собран из того же исходника той же версией схемы"""
+    if msgpack is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            blob = f.read()
+    except OSError:
+        return None
+    if len(blob) < SNAPSHOT_HEADER.size:
+        return None
+    magic, version, source_digest = SNAPSHOT_HEADER.unpack_from(blob)
+    if magic != SNAPSHOT_MAGIC or version != SCHEMA_VERSION or source_digest != digest:
+        return None
+    try:
+        payload = msgpack.unpackb(blob[SNAPSHOT_HEADER.size:], raw=False)
+    except ValueError as e:
+        logger.warning(f"Поврежденный снимок каталога {path}: {e}")
+        return None
+    fields = payload['fields']
+    return [dict(zip(fields, row)) for row in payload['rows']]
+
+
+def write_snapshot(path: str, templates: List[Dict], digest: bytes):
+    """Атомарная запись снимка: параллельные процессы видят старый или новый файл целиком"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(compile_catalog(templates, digest))
+    os.replace(tmp_path, path)
+
+
+def load_catalog(path: str) -> List[Dict]:
+    """Нормализованные шаблоны: из снимка, если он свежий, иначе из JSON с пересборкой снимка"""
+    try:
+        with open(path, 'rb') as f:
+            source = f.read()
+    except OSError as e:
+        raise TemplateCatalogError(f"{path}: {e}") from e
+    digest = hashlib.sha256(source).digest()
+    compiled = snapshot_path(path)
+
+    templates = read_snapshot(compiled, digest)
+    if templates is not None:
+        return templates
+
+    try:
+        templates = validate_templates(json.loads(source))
+    except ValueError as e:
+        # TemplateCatalogError и ошибки разбора JSON
+        raise TemplateCatalogError(f"{path}: {e}") from e
+
+    if msgpack is not None:
+        try:
+            write_snapshot(compiled, templates, digest)
+        except OSError as e:
+            logger.debug(f"Снимок каталога не записан ({compiled}): {e}")
+    return templates
+
+
+class TemplateCatalog:
+    """Неизменяемый снимок каталога с индексом и производными кэшами.
+
+    Обработчик берет снимок один раз и работает с ним до конца, поэтому
+    перезагрузка посреди обработки не дает ему смесь старых и новых данных.
+    Подписи, страницы и file_id хранятся в самом снимке и устаревают вместе с ним.
+    """
+
+    def __init__(self, templates: List[Dict], version: int = 1,
+                 source: Optional[str] = None, mtime: Optional[float] = None):
+        self.templates: Tuple[TemplateRecord, ...] = tuple(
+            TemplateRecord.from_dict(template) for template in templates
+        )
+        self.by_id: Mapping[int, TemplateRecord] = MappingProxyType({t.id: t for t in self.templates})
+        self.version = version
+        self.source = source
+        self.mtime = mtime
+        self._derived: Dict[Any, Any] = {}
+        # id шаблона -> file_id загруженного в Telegram превью
+        self.file_ids: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def get(self, template_id: int) -> Optional[TemplateRecord]:
+        return self.by_id.get(template_id)
+
+    def page(self, index: int, size: int) -> Tuple[TemplateRecord, ...]:
+        """Страница каталога (кэшируется в снимке)"""
+        return self.cached(('page', index, size), lambda: self.templates[index * size:(index + 1) * size])
+
+    def cached(self, key: Any, build: Callable[[], Any]) -> Any:
+        """Производное значение (подпись, клавиатура), вычисляемое один раз на снимок"""
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = build()
+            return value
+
+    def photo(self, template: TemplateRecord) -> str:
+        """file_id превью, если оно уже загружено, иначе URL"""
+        return self.file_ids.get(template.id, template.preview_image)
+
+    def remember_photo(self, template_id: int, message: Optional[Message]):
+        """Сохранение file_id из отправленного сообщения с превью"""
+        if isinstance(message, Message) and message.photo:
+            self.file_ids[template_id] = message.photo[-1].file_id
+
+    def inherit_file_ids(self, previous: 'TemplateCatalog'):
+        """Перенос file_id для шаблонов, у которых не изменилось превью"""
+        for template_id, file_id in previous.file_ids.items():
+            old, new = previous.get(template_id), self.get(template_id)
+            if old is not None and new is not None and old.preview_image == new.preview_image:
+                self.file_ids[template_id] = file_id
+
+
+class TemplateManager:
+    """Менеджер каталога шаблонов с перезагрузкой без перезапуска"""
+
+    def __init__(self, paths: Optional[List[str]] = None,
+                 check_interval: float = TEMPLATES_CHECK_INTERVAL):
+        self.paths = paths if paths is not None else TEMPLATE_PATHS
+        self.check_interval = check_interval
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        self._lock = asyncio.Lock()
+        # Производные кэши (веб-каталог и т.п.), обновляемые после каждой перезагрузки
+        self._listeners: List[Callable[[TemplateCatalog], Awaitable]] = []
+        try:
+            self.snapshot = self._build(self._find_source(), 1)
+        except TemplateCatalogError as e:
+            logger.error(f"Ошибка загрузки шаблонов: {e}")
+            self.snapshot = TemplateCatalog(validate_templates(DEMO_TEMPLATES), 1)
+
+    def _find_source(self) -> Optional[Tuple[str, float]]:
+        """Первый существующий файл шаблонов и время его изменения"""
+        for path in self.paths:
+            try:
+                return path, os.stat(path).st_mtime
+            except OSError:
+                continue
+        return None
+
+    def _build(self, source: Optional[Tuple[str, float]], version: int) -> TemplateCatalog:
+        """Чтение и проверка файла (выполняется вне event loop)"""
+        if source is None:
+            logger.warning("Файл шаблонов не найден, используем демо-данные")
+            return TemplateCatalog(validate_templates(DEMO_TEMPLATES), version)
+        path, mtime = source
+        templates = load_catalog(path)
+        return TemplateCatalog(templates, version, path, mtime)
+
+    async def reload(self, force: bool = False) -> TemplateCatalog:
+        """Перезагрузка каталога, если файл изменился (или принудительно).
+
+        При ошибке проверки остается текущий снимок, ошибка пробрасывается.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            current = self.snapshot
+            source = await loop.run_in_executor(None, self._find_source)
+            if source is None and current.source is not None:
+                # Файл временно пропал (например, при замене) - оставляем прежний каталог
+                return current
+            if not force and (source is None or source == (current.source, current.mtime)):
+                return current
+
+            try:
+                with span('store catalog.load'):
+                    snapshot = await loop.run_in_executor(None, self._build, source, current.version + 1)
+            except TemplateCatalogError as e:
+                self.reload_errors += 1
+                self.last_error = str(e)
+                logger.error(f"Каталог шаблонов не обновлен: {e}")
+                raise
+
+            snapshot.inherit_file_ids(current)
+            # Атомарная замена: новые апдейты видят новый снимок, текущие дорабатывают со старым
+            self.snapshot = snapshot
+            self.reloads += 1
+            self.last_error = None
+            logger.info(f"Каталог шаблонов обновлен: {len(snapshot)} шт., версия {snapshot.version}")
+            await self._notify(snapshot)
+            return snapshot
+
+    async def subscribe(self, listener: Callable[[TemplateCatalog], Awaitable]):
+        """Подписка на новые снимки; слушатель сразу получает текущий"""
+        self._listeners.append(listener)
+        await listener(self.snapshot)
+
+    async def _notify(self, snapshot: TemplateCatalog):
+        for listener in self._listeners:
+            try:
+                await listener(snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка обновления производного кэша каталога: {e}")
+
+    async def refresh(self):
+        """Периодическая проверка файла (задача планировщика): ошибки только в лог"""
+        try:
+            await self.reload()
+        except TemplateCatalogError:
+            pass
+
+    def get_templates(self) -> Tuple[TemplateRecord, ...]:
+        return self.snapshot.templates
+
+    def get_template_by_id(self, template_id: int) -> Optional[TemplateRecord]:
+        return self.snapshot.get(template_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "version": self.snapshot.version,
+            "templates": len(self.snapshot),
+            "source": self.snapshot.source,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Проверка и компиляция каталога при сборке: python template_catalog.py [templates.json]"""
+    parser = argparse.ArgumentParser(description="Validate templates.json and compile the catalog snapshot")
+    parser.add_argument('source', nargs='?', default=TEMPLATES_PATH)
+    parser.add_argument('-o', '--output', help="snapshot path (default: <source>.catalog)")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.source, 'rb') as f:
+            source = f.read()
+        templates = validate_templates(json.loads(source))
+    except (OSError, ValueError) as e:
+        print(f"{args.source}: {e}", file=sys.stderr)
+        return 1
+
+    if msgpack is None:
+        print(f"{args.source}: {len(templates)} templates OK (msgpack not installed, snapshot skipped)")
+        return 0
+    output = args.output or snapshot_path(args.source)
+    write_snapshot(output, templates, hashlib.sha256(source).digest())
+    print(f"{args.source}: {len(templates)} templates -> {output} (schema v{SCHEMA_VERSION})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+ProThemesRU Telegram Bot - EventStore tests
+Funnel counters and first-touch deep-link attribution
+"""
+
+import pytest
+
+from analytics import EventStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EventStore(str(tmp_path / 'analytics.db'))
+    yield store
+    store.close()
+
+
+def event(ts, name, user_id, detail='', campaign=None, template_id=None):
+    return ts, name, user_id, template_id, detail, campaign
+
+
+def campaign(store, name):
+    return next(item for item in store.campaigns() if item['campaign'] == name)
+
+
+def test_funnel_counts_unique_users(store):
+    store.write_batch([
+        event(1000, 'start', 1), event(1001, 'start', 1), event(1002, 'start', 2),
+        event(1003, 'templates', 1), event(1004, 'order', 1, detail='basic'),
+    ])
+    funnel = {step['step']: step['users'] for step in store.funnel()}
+    assert funnel == {'start': 2, 'templates': 1, 'view': 0, 'select': 0, 'order': 1}
+
+
+def test_new_user_attributed_to_campaign(store):
+    store.write_batch([
+        event(1000, 'start', 1, campaign='spring'),
+        event(1001, 'view', 1, template_id=3),
+        event(1002, 'order', 1, detail='pro'),
+    ])
+    spring = campaign(store, 'spring')
+    assert spring['start'] == 1 and spring['view'] == 1 and spring['order'] == 1
+    assert spring['conversion'] == 1.0
+
+
+def test_steps_before_first_start_not_backfilled(store):
+    store.write_batch([event(1000, 'templates', 1)])
+    store.write_batch([event(2000, 'start', 1, campaign='spring'), event(2001, 'view', 1, template_id=1)])
+    spring = campaign(store, 'spring')
+    assert spring['start'] == 1 and spring['view'] == 1 and spring['templates'] == 0
+
+
+def test_first_campaign_wins(store):
+    store.write_batch([event(1000, 'start', 1, campaign='spring')])
+    store.write_batch([event(2000, 'start', 1, campaign='autumn'), event(2001, 'order', 1, detail='pro')])
+    assert campaign(store, 'spring')['order'] == 1
+    assert all(item['campaign'] != 'autumn' for item in store.campaigns())
+
+
+def test_existing_user_clicking_campaign_link_is_not_attributed(store):
+    store.write_batch([event(1000, 'start', 1), event(1001, 'order', 1, detail='basic')])
+    store.write_batch([event(90000, 'start', 1, campaign='spring'), event(90001, 'view', 1, template_id=2)])
+    assert store.campaigns() == []
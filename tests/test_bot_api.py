@@ -0,0 +1,218 @@
+"""
+ProThemesRU Telegram Bot - ResilientRequest tests
+Runs the client against a local fake Bot API that injects failures
+"""
+
+import json
+import asyncio
+from typing import Dict, List
+
+import pytest
+from aiohttp import web
+from telegram.error import NetworkError
+
+import bot_api
+from bot_api import BotApiStats, CircuitBreaker, ResilientRequest
+
+OK = (200, {"ok": True, "result": True}, 0.0)
+
+
+class FakeBotApi:
+    """Заглушка Bot API: для каждого метода очередь ответов (статус, тело, задержка)"""
+
+    def __init__(self):
+        self.script: Dict[str, List] = {}
+        self.hits: Dict[str, int] = {}
+        self.runner = None
+        self.url = None
+
+    def reply(self, method: str, *responses):
+        self.script.setdefault(method, []).extend(responses)
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.hits[method] = self.hits.get(method, 0) + 1
+        responses = self.script.get(method)
+        status, body, delay = responses.pop(0) if responses else OK
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(body, status=status)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/bot1:test"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def error(status: int, retry_after: float = None):
+    body = {"ok": False, "error_code": status, "description": "injected"}
+    if retry_after is not None:
+        body["parameters"] = {"retry_after": retry_after}
+    return status, body, 0.0
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bot_api, 'BOT_API_BACKOFF_BASE', 0.0)
+
+
+def run(scenario, **request_kwargs):
+    """Сценарий получает заглушку и клиент со своим предохранителем и статистикой"""
+    async def main():
+        api = FakeBotApi()
+        await api.start()
+        request_kwargs.setdefault('breaker', CircuitBreaker(failure_threshold=3, reset_timeout=60))
+        request = ResilientRequest(stats=BotApiStats(), **request_kwargs)
+        await request.initialize()
+        try:
+            return await scenario(api, request)
+        finally:
+            await request.shutdown()
+            await api.stop()
+    return asyncio.run(main())
+
+
+def test_send_retried_when_unavailable():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(503), error(502))
+        status, payload = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 200 and json.loads(payload)["ok"]
+        assert api.hits['sendMessage'] == 3
+        assert request.stats.endpoints['sendMessage']['retries'] == 2
+        assert request.breaker.failures == 0
+    run(scenario)
+
+
+def test_send_not_retried_on_500_but_counts_as_failure():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(500))
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 500
+        assert api.hits['sendMessage'] == 1
+        assert request.breaker.failures == 1
+    run(scenario)
+
+
+def test_send_not_retried_on_gateway_timeout():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(504))
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 504
+        assert api.hits['sendMessage'] == 1
+        assert request.breaker.failures == 1
+    run(scenario)
+
+
+def test_idempotent_method_retried_on_gateway_timeout():
+    async def scenario(api, request):
+        api.reply('editMessageText', error(504))
+        status, _ = await request.do_request(f"{api.url}/editMessageText", 'POST')
+        assert status == 200
+        assert api.hits['editMessageText'] == 2
+    run(scenario)
+
+
+def test_idempotent_method_retried_on_500():
+    async def scenario(api, request):
+        api.reply('editMessageText', error(500), error(500))
+        status, _ = await request.do_request(f"{api.url}/editMessageText", 'POST')
+        assert status == 200
+        assert api.hits['editMessageText'] == 3
+    run(scenario)
+
+
+def test_rate_limit_waited_out_without_tripping_breaker():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(429, retry_after=0.05))
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 200
+        assert api.hits['sendMessage'] == 2
+        assert request.breaker.failures == 0
+    run(scenario)
+
+
+def test_long_retry_after_returned_to_caller():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(429, retry_after=60))
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 429
+        assert api.hits['sendMessage'] == 1
+    run(scenario)
+
+
+def test_client_error_closes_breaker():
+    async def scenario(api, request):
+        request.breaker.failures = 2
+        api.reply('sendMessage', error(400))
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 400
+        assert request.breaker.failures == 0
+        assert request.stats.endpoints['sendMessage']['errors'] == 1
+    run(scenario)
+
+
+def test_open_breaker_sheds_non_critical_and_probes_once():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(500), error(500), error(500), error(503))
+        for _ in range(3):
+            await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert request.breaker.state == 'open'
+
+        with pytest.raises(NetworkError):
+            await request.do_request(f"{api.url}/sendChatAction", 'POST')
+        with bot_api.non_critical():
+            with pytest.raises(NetworkError):
+                await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert 'sendChatAction' not in api.hits
+        assert request.stats.endpoints['sendChatAction']['shed'] == 1
+
+        # Важный запрос при открытом предохранителе уходит один раз, без повторов
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 503
+        assert api.hits['sendMessage'] == 4
+    run(scenario)
+
+
+def test_breaker_closes_after_successful_probe():
+    async def scenario(api, request):
+        api.reply('sendMessage', error(500), error(500), error(500))
+        for _ in range(3):
+            await request.do_request(f"{api.url}/sendMessage", 'POST')
+        request.breaker.reset_timeout = 0
+        assert request.breaker.state == 'half_open'
+        status, _ = await request.do_request(f"{api.url}/sendMessage", 'POST')
+        assert status == 200
+        assert request.breaker.state == 'closed'
+    run(scenario)
+
+
+def test_slow_read_is_hedged():
+    async def scenario(api, request):
+        api.reply('getChat', (200, {"ok": True, "result": "slow"}, 2.0))
+        status, payload = await request.do_request(f"{api.url}/getChat", 'POST')
+        assert status == 200
+        assert json.loads(payload)["result"] is True
+        assert api.hits['getChat'] == 2
+        assert request.stats.endpoints['getChat']['hedged'] == 1
+    run(scenario, hedge_delay=0.1)
+
+
+def test_unreachable_api_retried_then_raised():
+    async def scenario(api, request):
+        url = api.url
+        await api.stop()
+        with pytest.raises(NetworkError):
+            await request.do_request(f"{url}/sendMessage", 'POST')
+        stats = request.stats.endpoints['sendMessage']
+        assert stats['calls'] == bot_api.BOT_API_MAX_RETRIES + 1
+        assert stats['retries'] == bot_api.BOT_API_MAX_RETRIES
+        await api.start()
+    run(scenario, breaker=CircuitBreaker(failure_threshold=100))
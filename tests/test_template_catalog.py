@@ -0,0 +1,131 @@
+"""
+ProThemesRU Telegram Bot - Template catalog tests
+Schema validation, normalization and hot reload that keeps the last good catalog
+"""
+
+import json
+import asyncio
+
+import pytest
+
+from template_catalog import (
+    TemplateCatalogError, TemplateManager, load_catalog, normalize_category, normalize_price, validate_templates
+)
+
+
+def template(template_id=1, **fields):
+    return {
+        "id": template_id,
+        "name": f"Шаблон {template_id}",
+        "category": "Бизнес",
+        "price": "5 000 руб.",
+        "description": "Описание",
+        "preview_image": "https://example.com/1.png",
+        **fields,
+    }
+
+
+def write(path, data):
+    path.write_text(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False), encoding='utf-8')
+
+
+@pytest.mark.parametrize('value, expected', [
+    (15000, 15000), (15000.0, 15000), ("5000₽", 5000), ("5 000 руб.", 5000), ("8000,00 р.", 8000), ("4000rub", 4000),
+])
+def test_normalize_price(value, expected):
+    assert normalize_price(value) == expected
+
+
+@pytest.mark.parametrize('value', [True, -1, "бесплатно", "5000$", None, 12.5])
+def test_normalize_price_rejects(value):
+    with pytest.raises(TemplateCatalogError):
+        normalize_price(value)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ("Бизнес", "business"), ("E-commerce", "ecommerce"), ("Real Estate", "real-estate"), (" saas ", "saas"),
+])
+def test_normalize_category(value, expected):
+    assert normalize_category(value) == expected
+
+
+def test_validate_sections_and_defaults():
+    templates = validate_templates({
+        "premium_templates": [template(1, features=["SEO"])],
+        "basic_templates": [template(2, name="  Визитка  ")],
+    })
+    assert [(t['id'], t['tier']) for t in templates] == [(1, 'premium'), (2, 'basic')]
+    assert templates[0]['price'] == 5000 and templates[0]['category'] == 'business'
+    assert templates[0]['features'] == ["SEO"] and templates[1]['features'] == []
+    assert templates[1]['name'] == "Визитка"
+
+
+@pytest.mark.parametrize('data', [
+    {"unknown": []},
+    {"premium_templates": {}},
+    [template(1), template(1)],
+    [template(1, price="дорого")],
+    [template(1, name="")],
+    [{k: v for k, v in template(1).items() if k != 'preview_image'}],
+    [template(1, tier='gold')],
+    [template(1, features="SEO")],
+    [template("1")],
+])
+def test_validate_rejects_malformed(data):
+    with pytest.raises(TemplateCatalogError):
+        validate_templates(data)
+
+
+def test_load_catalog_reports_invalid_json(tmp_path):
+    path = tmp_path / 'templates.json'
+    write(path, '{"premium_templates": [')
+    with pytest.raises(TemplateCatalogError):
+        load_catalog(str(path))
+
+
+def test_reload_keeps_current_snapshot_on_malformed_file(tmp_path):
+    path = tmp_path / 'templates.json'
+    write(path, [template(1), template(2)])
+
+    async def scenario():
+        manager = TemplateManager(paths=[str(path)])
+        current = manager.snapshot
+        assert len(current) == 2 and current.get(1).price == 5000
+
+        write(path, [template(1), template(1)])
+        with pytest.raises(TemplateCatalogError):
+            await manager.reload(force=True)
+        assert manager.snapshot is current
+        assert manager.reload_errors == 1 and manager.last_error
+
+        # Фоновая проверка тоже не роняет бота и не меняет каталог
+        write(path, '{broken')
+        await manager.refresh()
+        assert manager.snapshot is current
+
+        write(path, [template(1), template(2), template(3)])
+        snapshot = await manager.reload(force=True)
+        assert manager.snapshot is snapshot and len(snapshot) == 3
+        assert snapshot.version == current.version + 1
+        assert manager.last_error is None
+
+    asyncio.run(scenario())
+
+
+def test_reload_notifies_subscribers(tmp_path):
+    path = tmp_path / 'templates.json'
+    write(path, [template(1)])
+
+    async def scenario():
+        manager = TemplateManager(paths=[str(path)])
+        seen = []
+
+        async def listener(catalog):
+            seen.append(len(catalog))
+
+        await manager.subscribe(listener)
+        write(path, [template(1), template(2)])
+        await manager.reload(force=True)
+        assert seen == [1, 2]
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+"""
+ProThemesRU Telegram Bot - ThrottleManager tests
+Debounce, sliding-window rate limit, mutes and state pruning
+"""
+
+from throttling import DEBOUNCED, MUTED, RATE_LIMITED, ThrottleManager
+
+
+def manager(**kwargs):
+    settings = dict(rate_limit=3, rate_window=10, debounce_window=1.5, mute_after=2, mute_duration=60)
+    settings.update(kwargs)
+    return ThrottleManager(**settings)
+
+
+def test_allows_up_to_rate_limit():
+    throttle = manager()
+    assert [throttle.check(1, now=t) for t in (0, 1, 2)] == [None, None, None]
+    assert throttle.check(1, now=3) == RATE_LIMITED
+    # Лимит у каждого пользователя свой
+    assert throttle.check(2, now=3) is None
+
+
+def test_window_slides():
+    throttle = manager()
+    for t in (0, 1, 2):
+        throttle.check(1, now=t)
+    assert throttle.check(1, now=9.9) == RATE_LIMITED
+    assert throttle.check(1, now=10.0) is None
+
+
+def test_debounces_same_button_only():
+    throttle = manager(rate_limit=100)
+    assert throttle.check(1, 'templates', now=0) is None
+    assert throttle.check(1, 'templates', now=1) == DEBOUNCED
+    assert throttle.check(1, 'help', now=1.1) is None
+    assert throttle.check(1, 'help', now=2.7) is None
+
+
+def test_mutes_after_repeated_violations():
+    throttle = manager()
+    for t in (0, 1, 2):
+        throttle.check(1, now=t)
+    assert throttle.check(1, now=3) == RATE_LIMITED
+    assert throttle.check(1, now=4) == MUTED
+    # Во время мьюта отклоняется все, даже после освобождения окна
+    assert throttle.check(1, now=30) == MUTED
+    assert throttle.check(1, now=64.1) is None
+    assert throttle.get_stats()["muted_users"] == 0
+
+
+def test_prune_drops_idle_users():
+    throttle = manager()
+    for user_id in range(100):
+        throttle.check(user_id, 'templates', now=0)
+    assert throttle.get_stats()["tracked_users"] == 100
+    throttle.check(1000, now=20)
+    assert throttle.get_stats()["tracked_users"] == 1
+    assert len(throttle.last_callback) == 0
@@ -0,0 +1,147 @@
+"""
+ProThemesRU Telegram Bot - Anti-spam middleware
+Per-user callback debouncing, sliding-window rate limits and short mutes
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from i18n import catalog, get_locale
+
+logger = logging.getLogger(__name__)
+
+# Настройки антиспама
+THROTTLE_RATE_LIMIT = int(os.getenv('THROTTLE_RATE_LIMIT', '20'))
+THROTTLE_RATE_WINDOW = float(os.getenv('THROTTLE_RATE_WINDOW', '10'))
+THROTTLE_DEBOUNCE_WINDOW = float(os.getenv('THROTTLE_DEBOUNCE_WINDOW', '1.5'))
+THROTTLE_MUTE_AFTER = int(os.getenv('THROTTLE_MUTE_AFTER', '3'))
+THROTTLE_MUTE_DURATION = float(os.getenv('THROTTLE_MUTE_DURATION', '60'))
+
+# Причины отклонения апдейта
+DEBOUNCED = 'debounced'
+RATE_LIMITED = 'rate_limited'
+MUTED = 'muted'
+
+
+class ThrottleManager:
+    """Антиспам: дебаунс кнопок, лимит апдейтов и временный мьют"""
+
+    def __init__(
+        self,
+        rate_limit: int = THROTTLE_RATE_LIMIT,
+        rate_window: float = THROTTLE_RATE_WINDOW,
+        debounce_window: float = THROTTLE_DEBOUNCE_WINDOW,
+        mute_after: int = THROTTLE_MUTE_AFTER,
+        mute_duration: float = THROTTLE_MUTE_DURATION,
+    ):
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.debounce_window = debounce_window
+        self.mute_after = mute_after
+        self.mute_duration = mute_duration
+
+        # Все словари содержат только активных пользователей и чистятся в prune()
+        self.events: Dict[int, Deque[float]] = {}
+        self.last_callback: Dict[int, Tuple[str, float]] = {}
+        self.strikes: Dict[int, int] = {}
+        self.muted_until: Dict[int, float] = {}
+        self._next_prune = 0.0
+
+    def check(self, user_id: int, callback_data: Optional[str] = None,
+              now: Optional[float] = None) -> Optional[str]:
+        """Проверка апдейта; возвращает причину отклонения или None"""
+        if now is None:
+            now = time.monotonic()
+
+        if now >= self._next_prune:
+            self.prune(now)
+
+        muted_until = self.muted_until.get(user_id)
+        if muted_until is not None:
+            if now < muted_until:
+                return MUTED
+            del self.muted_until[user_id]
+            self.strikes.pop(user_id, None)
+
+        # Повторное нажатие той же кнопки в пределах окна
+        if callback_data is not None:
+            last = self.last_callback.get(user_id)
+            if last and last[0] == callback_data and now - last[1] < self.debounce_window:
+                return DEBOUNCED
+            self.last_callback[user_id] = (callback_data, now)
+
+        # Скользящее окно запросов
+        window = self.events.get(user_id)
+        if window is None:
+            window = self.events[user_id] = deque()
+        while window and now - window[0] >= self.rate_window:
+            window.popleft()
+
+        if len(window) >= self.rate_limit:
+            strikes = self.strikes.get(user_id, 0) + 1
+            self.strikes[user_id] = strikes
+            if strikes >= self.mute_after:
+                self.muted_until[user_id] = now + self.mute_duration
+                window.clear()
+                logger.warning(f"Пользователь {user_id} заглушен на {self.mute_duration:.0f} с за флуд")
+                return MUTED
+            return RATE_LIMITED
+
+        window.append(now)
+        return None
+
+    def prune(self, now: Optional[float] = None):
+        """Удаление состояния неактивных пользователей"""
+        if now is None:
+            now = time.monotonic()
+
+        for user_id in [u for u, w in self.events.items() if not w or now - w[-1] >= self.rate_window]:
+            del self.events[user_id]
+            if user_id not in self.muted_until:
+                self.strikes.pop(user_id, None)
+        for user_id in [u for u, (_, ts) in self.last_callback.items() if now - ts >= self.debounce_window]:
+            del self.last_callback[user_id]
+        for user_id in [u for u, until in self.muted_until.items() if now >= until]:
+            del self.muted_until[user_id]
+            self.strikes.pop(user_id, None)
+
+        self._next_prune = now + self.rate_window
+
+    def get_stats(self) -> Dict:
+        return {
+            "tracked_users": len(self.events),
+            "muted_users": len(self.muted_until),
+        }
+
+
+throttle_manager = ThrottleManager()
+
+
+async def throttle_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Фильтр апдейтов перед основными обработчиками (группа -1)"""
+    user = update.effective_user
+    if user is None:
+        return
+
+    query = update.callback_query
+    reason = throttle_manager.check(user.id, query.data if query else None)
+    if reason is None:
+        return
+
+    # Снимаем "часики" с кнопки, но для заглушенных не тратим запросы
+    if query is not None and reason != MUTED:
+        try:
+            if reason == RATE_LIMITED:
+                await query.answer(catalog.get(get_locale(update), 'throttle.rate_limited'))
+            else:
+                await query.answer()
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на callback: {e}")
+
+    raise ApplicationHandlerStop
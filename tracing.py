@@ -0,0 +1,255 @@
+"""
+ProThemesRU Telegram Bot - Update tracing
+Opt-in sampled traces: a root span per update (or background job) with
+child spans for handlers, Bot API calls and store access, kept in a ring
+buffer for /traces and optionally exported as OTLP JSON lines
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, BaseHandler, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# Доля трассируемых апдейтов и задач: 0 - трассировка выключена, 1 - все
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '200'))
+# Файл для выгрузки (OTLP JSON, одна пачка на строку); пусто - только буфер в памяти
+TRACE_FILE = os.getenv('TRACE_FILE')
+TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', '10'))
+TRACE_SERVICE_NAME = 'prothemesru-bot'
+
+# Исключения, которыми обработчики управляют диспетчеризацией, а не сообщают об ошибке
+FLOW_CONTROL = (ApplicationHandlerStop,)
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    """Участок трассы; время - наносекунды Unix, как в OTLP"""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        """Длительность в секундах (незавершенный участок - до текущего момента)"""
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or self.start),
+            "attributes": [otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Трасса одного апдейта или запуска фоновой задачи"""
+
+    __slots__ = ('trace_id', 'root', 'spans')
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+        self.root = self.open(name, None, attributes)
+
+    def open(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> Span:
+        span = Span(self, name, parent_id, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration
+
+
+def otlp_attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Tracer:
+    """Выборка, буфер последних трасс и выгрузка в файл"""
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, buffer_size: int = TRACE_BUFFER_SIZE,
+                 path: Optional[str] = TRACE_FILE):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.buffer: Deque[Trace] = deque(maxlen=buffer_size)
+        self.pending: List[Trace] = []
+        self.traced = 0
+        self.exported = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Корневой участок; вне выборки - ничего не записывается"""
+        if not self.enabled or _current_span.get() is not None or random.random() >= self.sample_rate:
+            yield None
+            return
+        trace = Trace(name, attributes)
+        token = _current_span.set(trace.root)
+        try:
+            yield trace.root
+        except FLOW_CONTROL:
+            raise
+        except BaseException as e:
+            trace.root.error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            trace.root.end = time.time_ns()
+            self.traced += 1
+            self.buffer.append(trace)
+            if self.path:
+                self.pending.append(trace)
+
+    def slowest(self, limit: int) -> List[Trace]:
+        return sorted(self.buffer, key=lambda trace: -trace.duration)[:limit]
+
+    async def export(self):
+        """Дозапись накопленных трасс в файл вне event loop (задача планировщика)"""
+        if not self.pending or not self.path:
+            return
+        batch, self.pending = self.pending, []
+        await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+        self.exported += len(batch)
+
+    def _write(self, batch: List[Trace]):
+        document = {
+            "resourceSpans": [{
+                "resource": {"attributes": [otlp_attribute('service.name', TRACE_SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp() for trace in batch for span in trace.spans],
+                }],
+            }]
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(document, ensure_ascii=False) + '\n')
+
+    def get_stats(self) -> Dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "traced": self.traced,
+            "buffered": len(self.buffer),
+            "exported": self.exported,
+        }
+
+
+tracer = Tracer()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Дочерний участок текущей трассы; без активной трассы почти ничего не стоит"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace.open(name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except FLOW_CONTROL:
+        raise
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end = time.time_ns()
+
+
+def update_attributes(update: object) -> Dict[str, Any]:
+    """Атрибуты корневого участка: тип апдейта, команда или кнопка"""
+    if not isinstance(update, Update):
+        return {"telegram.update_type": type(update).__name__}
+    attributes: Dict[str, Any] = {"telegram.update_id": update.update_id}
+    for update_type in Update.ALL_TYPES:
+        if getattr(update, update_type, None) is not None:
+            attributes["telegram.update_type"] = str(update_type)
+            break
+    if update.callback_query is not None:
+        attributes["telegram.callback_data"] = update.callback_query.data or ''
+    elif update.effective_message is not None and (update.effective_message.text or '').startswith('/'):
+        attributes["telegram.command"] = update.effective_message.text.split(maxsplit=1)[0]
+    return attributes
+
+
+class TracingApplication(Application):
+    """Application, открывающий корневой участок dispatch на каждый апдейт из выборки"""
+
+    async def process_update(self, update: object) -> None:
+        if not tracer.enabled:
+            return await super().process_update(update)
+        with tracer.trace('dispatch', **update_attributes(update)):
+            await super().process_update(update)
+
+
+def _traced_callback(callback):
+    name = f"handler {getattr(callback, '__qualname__', repr(callback))}"
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with span(name):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def _instrument_handler(handler: BaseHandler):
+    if isinstance(handler, ConversationHandler):
+        nested = handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]
+        for child in nested:
+            _instrument_handler(child)
+    elif getattr(handler, 'callback', None) is not None:
+        handler.callback = _traced_callback(handler.callback)
+
+
+def instrument(application: Application):
+    """Участок на каждый вызов обработчика; при выключенной трассировке ничего не меняет"""
+    if not tracer.enabled:
+        return
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)